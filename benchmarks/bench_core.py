@@ -0,0 +1,112 @@
+"""Benchmarks for the display and presentation helpers in ipytools._core
+
+Suites follow the airspeed velocity layout (`params`, `param_names`,
+`setup`, `time_*`) and run with `python benchmarks/run.py`.
+"""
+import os
+import shutil
+import tempfile
+
+from ipytools import _core
+
+
+def _require(module):
+    try:
+        return __import__(module, fromlist=['*'])
+    except ImportError:
+        raise NotImplementedError('{} is not installed'.format(module))
+
+
+class _NoDisplay(object):
+    """replace IPython's `display` so benchmarks measure HTML building only
+
+    _core imports `display` when it is called, so patching the function on
+    IPython.display is enough.
+    """
+    def setup_display(self):
+        self._ipython_display = _require('IPython.display')
+        self._display = self._ipython_display.display
+        self._ipython_display.display = lambda *objs, **kwargs: None
+
+    def teardown_display(self):
+        self._ipython_display.display = self._display
+
+
+class HDisplaySuite(_NoDisplay):
+    params = ([1, 4, 16], [10, 1000])
+    param_names = ['frames', 'rows']
+
+    def setup(self, frames, rows):
+        pd = _require('pandas')
+        np = _require('numpy')
+        self.frames = [pd.DataFrame(np.random.randint(0, 10, (rows, 5)))
+                       for _ in range(frames)]
+        self.setup_display()
+
+    def teardown(self, frames, rows):
+        self.teardown_display()
+
+    def time_hdisplay(self, frames, rows):
+        _core.hdisplay(*self.frames)
+
+
+class HTMLBufferSuite(object):
+    params = ([10, 1000], [10, 1000])
+    param_names = ['writes', 'chars']
+
+    def setup(self, writes, chars):
+        self.text = 'word\tand more\n' * (chars // 14 + 1)
+        self.items = ['item {}'.format(i) for i in range(chars // 10 + 1)]
+
+    def time_write_text(self, writes, chars):
+        buf = _core.HTMLBuffer()
+        for _ in range(writes):
+            buf.write(self.text)
+
+    def time_write_list(self, writes, chars):
+        buf = _core.HTMLBuffer()
+        for _ in range(writes):
+            buf.write(self.items)
+
+
+class SlideSuite(_NoDisplay):
+    params = ([1, 10], [100, 10000])
+    param_names = ['slides', 'points']
+
+    def setup(self, slides, points):
+        self.plt = _require('matplotlib.pyplot')
+        np = _require('numpy')
+        self.xs = np.arange(points)
+        self.ys = np.random.randn(points).cumsum()
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.setup_display()
+
+    def teardown(self, slides, points):
+        self.teardown_display()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def time_presentation(self, slides, points):
+        with _core.Presentation('bench.slides.html'):
+            for i in range(slides):
+                with _core.slide():
+                    self.plt.plot(self.xs, self.ys)
+                    print('slide {}'.format(i))
+
+
+class BuildHTMLSuite(object):
+    params = ([10, 100, 1000],)
+    param_names = ['slides']
+
+    def setup(self, slides):
+        _require('jinja2')
+        self.presentation = _core.Presentation('bench.slides.html')
+        self.presentation.presentation = [
+            '<section><p>slide {}</p>{}</section>'.format(i, '<b>x</b>' * 200)
+            for i in range(slides)
+        ]
+
+    def time_build_html(self, slides):
+        self.presentation.build_html()
@@ -0,0 +1,98 @@
+"""Benchmarks for the `%export` pipeline in ipytools/magics/export.py"""
+import json
+import os
+import shutil
+import tempfile
+
+from ipytools import _export
+
+EXPORT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'ipytools', 'magics', 'export.py')
+
+
+def _notebook(cells):
+    return {
+        'metadata': {},
+        'nbformat': 4,
+        'nbformat_minor': 0,
+        'cells': [
+            {
+                'cell_type': 'code',
+                'execution_count': cells - i,
+                'metadata': {},
+                'source': ['x = {}\n'.format(i), 'x * 2'],
+                'outputs': [{
+                    'output_type': 'execute_result',
+                    'execution_count': cells - i,
+                    'metadata': {},
+                    'data': {'text/plain': [str(i * 2)]},
+                }],
+            }
+            for i in range(cells)
+        ],
+    }
+
+
+def _load_source(name, path):
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _load_magic():
+    try:
+        export = _load_source('ipytools_export_bench', EXPORT)
+    except Exception as e:
+        raise NotImplementedError('export magic cannot be loaded: {}'.format(e))
+    return export.ExportMagic(shell=None)
+
+
+class ExportNotebookSuite(object):
+    """`_export.export_notebook` with nbconvert's default markdown template
+
+    In-process with nbconvert < 6, where the cached exporter is reused by
+    every sample; a `python -m nbconvert` subprocess with later versions.
+    """
+    params = ([10, 100],)
+    param_names = ['cells']
+
+    def setup(self, cells):
+        if not _export.available():
+            raise NotImplementedError('nbconvert is not installed')
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'bench.ipynb')
+        with open(self.path, 'w') as f:
+            json.dump(_notebook(cells), f)
+        # the first export builds the exporter; time the later ones
+        _export.export_notebook(self.path, to='markdown', build_directory=self.tmp)
+
+    def teardown(self, cells):
+        shutil.rmtree(self.tmp)
+
+    def time_export_markdown(self, cells):
+        _export.export_notebook(self.path, to='markdown', build_directory=self.tmp)
+
+
+class ExportSuite(object):
+    params = ([10, 100, 1000],)
+    param_names = ['cells']
+
+    def setup(self, cells):
+        self.magic = _load_magic()
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'bench.ipynb')
+        self.source = json.dumps(_notebook(cells))
+
+    def teardown(self, cells):
+        shutil.rmtree(self.tmp)
+
+    def time_rewrite_execution_order(self, cells):
+        with open(self.path, 'w') as f:
+            f.write(self.source)
+        self.magic._rewrite_execution_order(self.path)
@@ -0,0 +1,62 @@
+"""Benchmarks for the cost of `import ipytools` in a fresh interpreter
+
+Each sample starts a new interpreter, so compare `time_import_ipytools`
+with `time_interpreter_startup` to get the import cost itself.  Setup
+fails when `import ipytools` pulls in matplotlib, mpld3, jinja2 or
+IPython, which must only load on first use of the helpers that need them,
+or when the import itself, timed inside a fresh interpreter (best of
+`SAMPLES`), takes longer than `BUDGET_MS`.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('matplotlib', 'mpld3', 'jinja2', 'IPython')
+BUDGET_MS = 50
+SAMPLES = 5
+
+_CHECK = """
+import sys
+import ipytools
+sys.stdout.write(' '.join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+_TIMED = """
+import sys, time
+start = time.time()
+import ipytools
+sys.stdout.write(repr(time.time() - start))
+"""
+
+
+def _python(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [path for path in [env.get('PYTHONPATH')] if path])
+    process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError(err.decode('utf-8', 'replace'))
+    return out.decode('utf-8')
+
+
+def import_ms(samples=SAMPLES):
+    """best wall time of `import ipytools` in a fresh interpreter, in ms"""
+    return min(float(_python(_TIMED)) for _ in range(samples)) * 1e3
+
+
+class ImportSuite(object):
+    def setup(self):
+        loaded = _python(_CHECK.format(heavy=HEAVY)).strip()
+        if loaded:
+            raise AssertionError('import ipytools loaded {}'.format(loaded))
+        cost = import_ms()
+        if cost > BUDGET_MS:
+            raise AssertionError('import ipytools took {:.1f} ms, budget is {} ms'.format(cost, BUDGET_MS))
+
+    def time_interpreter_startup(self):
+        _python('pass')
+
+    def time_import_ipytools(self):
+        _python('import ipytools')
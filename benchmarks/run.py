@@ -0,0 +1,146 @@
+"""Run the ipytools benchmark suites offline and write JSON results
+
+Every `bench_*.py` module in this directory is scanned for classes with
+`time_*` methods.  Parameterized classes (`params`, `param_names`) run
+once per combination; `setup` raising NotImplementedError skips a
+combination, e.g. when an optional dependency is missing; any other
+setup error fails the combination.  Each benchmark is measured with
+`Timer.bench`, and the exit status is 1 when any benchmark failed.
+
+Usage
+-----
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py --quick -b HTMLBuffer
+"""
+import argparse
+import datetime
+import glob
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import re
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from ipytools import Timer
+
+
+def _suites(pattern):
+    for path in sorted(glob.glob(os.path.join(HERE, 'bench_*.py'))):
+        module_name = 'benchmarks.' + os.path.splitext(os.path.basename(path))[0]
+        module = importlib.import_module(module_name)
+        for class_name, cls in sorted(inspect.getmembers(module, inspect.isclass)):
+            if cls.__module__ != module.__name__ or class_name.startswith('_'):
+                continue
+            methods = sorted(name for name in dir(cls) if name.startswith('time_'))
+            for method in methods:
+                name = '{}.{}.{}'.format(module_name.split('.', 1)[1], class_name, method)
+                if re.search(pattern, name):
+                    yield name, cls, method
+
+
+def _combinations(cls):
+    params = getattr(cls, 'params', None)
+    if not params:
+        return [()]
+    if not isinstance(params[0], (list, tuple)):
+        params = (params,)
+    return list(itertools.product(*params))
+
+
+def run(pattern='', repeat=20, target=0.02, stream=sys.stderr):
+    """run every matching benchmark
+
+    Parameters
+    ----------
+    pattern : str
+        regular expression matched against 'module.Class.time_method'
+    repeat : int
+        samples per benchmark
+    target : float
+        seconds per sample used to calibrate the loop count
+
+    Returns
+    -------
+    results : list
+        one dict per benchmark and parameter combination
+    """
+    results = []
+    for name, cls, method in _suites(pattern):
+        param_names = getattr(cls, 'param_names', [])
+        for combination in _combinations(cls):
+            params = dict(zip(param_names, combination))
+            record = {'benchmark': name, 'params': params}
+            suite = cls()
+            try:
+                if hasattr(suite, 'setup'):
+                    suite.setup(*combination)
+            except NotImplementedError as e:
+                record['skipped'] = str(e)
+                results.append(record)
+                stream.write('{} {} skipped: {}\n'.format(name, params, e))
+                continue
+            except Exception as e:
+                record['error'] = '{}: {}'.format(type(e).__name__, e)
+                results.append(record)
+                stream.write('{} {} setup failed: {}\n'.format(name, params, record['error']))
+                continue
+            try:
+                func = getattr(suite, method)
+                result = Timer.bench(func, args=combination, repeat=repeat,
+                                     target=target, name=name)
+                record.update({
+                    'number': result.number,
+                    'repeat': result.repeat,
+                    'unit': 'ns',
+                    'stats': result.stats,
+                    'samples': result.samples,
+                })
+                stream.write('{} {} median {:.0f} ns\n'.format(name, params, result.median))
+            except Exception as e:
+                record['error'] = '{}: {}'.format(type(e).__name__, e)
+                stream.write('{} {} failed: {}\n'.format(name, params, record['error']))
+            finally:
+                if hasattr(suite, 'teardown'):
+                    suite.teardown(*combination)
+            results.append(record)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-b', '--bench', default='',
+                        help='regular expression selecting benchmarks')
+    parser.add_argument('-o', '--output', default=None,
+                        help='JSON file to write, default stdout')
+    parser.add_argument('-r', '--repeat', type=int, default=20,
+                        help='samples per benchmark')
+    parser.add_argument('--quick', action='store_true',
+                        help='3 samples of ~5 ms each, for smoke runs')
+    args = parser.parse_args(argv)
+
+    repeat, target = (3, 0.005) if args.quick else (args.repeat, 0.02)
+    document = {
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'results': run(args.bench, repeat=repeat, target=target),
+    }
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+    return 1 if any('error' in record for record in document['results']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
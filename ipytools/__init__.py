@@ -1,12 +1,29 @@
-from _core import (Suppress, 
+from ._core import (Suppress, 
                    Redirect, 
                    Timer,
+                   Profile,
                    Presentation,
                    slide, 
                    mplrc, 
                    hdisplay, 
                    get_classname)
+from ._collector import TimerCollector
+from ._metrics import MetricsRegistry, metrics
 
-import injections
+from . import injections
+from . import _telemetry
+
+
+def load_ipython_extension(ip):
+    """`%load_ext ipytools`: record cell telemetry and add `%cellstats`
+
+    Listing ipytools in `c.InteractiveShellApp.extensions` turns telemetry
+    on for every kernel, including scheduled notebooks.
+    """
+    _telemetry.enable(ip)
+    ip.extension_manager.load_extension('cellstats')
+
+
+_telemetry.enable_in_ipython()
 
 
@@ -0,0 +1,255 @@
+"""Persisted timing baselines and regression checks
+
+Baselines are JSON files in ~/.ipython/ipytools/baselines (or the
+directory named by IPYTOOLS_BASELINE_DIR), one file per key, holding the
+raw samples in nanoseconds.  Files are replaced atomically so concurrent
+notebooks never read a half-written baseline, and appends hold a lock so
+they never drop each other's samples.
+"""
+import json
+import os
+import platform
+import re
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: appends are only serialized within this process
+    fcntl = None
+
+from . import _stats
+from ._html import escape
+
+BASELINE_DIR_ENV = 'IPYTOOLS_BASELINE_DIR'
+DEFAULT_DIR = '~/.ipython/ipytools/baselines'
+# appends keep the newest samples up to this many
+MAX_SAMPLES = 1000
+# ratios closer to 1 than this are reported as no change even when significant
+MIN_CHANGE = 0.01
+
+_lock = threading.Lock()
+
+
+def baseline_dir():
+    """directory holding baseline files, created on first use"""
+    directory = os.path.expanduser(os.environ.get(BASELINE_DIR_ENV, DEFAULT_DIR))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def _path(key):
+    if not key or not re.match(r'^[\w.-]+$', key):
+        raise ValueError('baseline keys may only contain letters, digits, "_", "." and "-"')
+    return os.path.join(baseline_dir(), '{}.json'.format(key))
+
+
+def load(key):
+    """return the stored baseline document for `key`
+
+    Raises
+    ------
+    KeyError
+        when no baseline was saved under `key`
+    """
+    path = _path(key)
+    if not os.path.exists(path):
+        raise KeyError('no baseline saved under {!r}'.format(key))
+    with open(path) as f:
+        return json.load(f)
+
+
+class _FileLock(object):
+    """exclusive lock on `path` across threads and, with fcntl, processes"""
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        _lock.acquire()
+        try:
+            if fcntl is not None:
+                self._file = open(self.path, 'a')
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            _lock.release()
+            raise
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if self._file is not None:
+                # closing releases the flock
+                self._file.close()
+                self._file = None
+        finally:
+            _lock.release()
+
+
+def save(key, samples, append=False, meta=None, max_samples=MAX_SAMPLES):
+    """store `samples` (ns) under `key`
+
+    Parameters
+    ----------
+    key : str
+        baseline name
+    samples : list
+        timing samples in nanoseconds
+    append : bool
+        add to the samples already stored instead of replacing them
+    meta : dict, optional
+        extra fields stored with the samples
+    max_samples : int
+        with `append`, the oldest samples beyond this many are dropped
+
+    Returns
+    -------
+    path : str
+        baseline file
+    """
+    path = _path(key)
+    samples = list(samples)
+    # an append reads, merges and replaces; no other save may run in between
+    with _FileLock(path + '.lock'):
+        if append and os.path.exists(path):
+            samples = (load(key)['samples'] + samples)[-max_samples:]
+        return _write(key, path, samples, meta)
+
+
+def _write(key, path, samples, meta):
+    document = {
+        'key': key,
+        'samples': samples,
+        'saved': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'meta': meta or {},
+    }
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(document, f)
+    os.rename(tmp, path)
+    return path
+
+
+def compare(key, samples, alpha=0.05):
+    """compare new `samples` (ns) with the baseline stored under `key`
+
+    Returns
+    -------
+    comparison : Comparison
+    """
+    return Comparison(key, load(key)['samples'], list(samples), alpha=alpha)
+
+
+def min_pvalue(n_baseline, n_current):
+    """smallest p-value `Comparison` can reach with these sample counts
+
+    A single new sample ranked against n baseline samples cannot go below
+    2 / (n + 1), so it needs 40 baseline samples for p < 0.05.  With
+    several samples on both sides the Mann-Whitney test needs at least 4
+    on each side (5 each gives p ~ 0.012).
+    """
+    if not n_baseline or not n_current:
+        return 1.0
+    if n_current == 1 or n_baseline == 1:
+        return min(1.0, 2.0 / (max(n_baseline, n_current) + 1))
+    # complete separation of the two samples gives the smallest U
+    return _stats.mann_whitney(range(n_current), range(n_current, n_current + n_baseline))[1]
+
+
+class Comparison(object):
+    """Outcome of comparing new timings with a stored baseline
+
+    With several samples on both sides the p-value comes from a two-sided
+    Mann-Whitney U test and the interval from a bootstrap of the ratio of
+    medians.  A single new sample is ranked against the baseline samples
+    instead (empirical two-sided p-value) and has no interval.
+
+    A ratio that is not significant, or within `MIN_CHANGE` of 1, is
+    reported as "no significant change".  When the sample counts cannot
+    reach `alpha` at all (see `min_pvalue`) it adds "insufficient samples".
+
+    Attributes
+    ----------
+    ratio : float
+        median(current) / median(baseline); above 1 means slower
+    pvalue : float
+    interval : tuple or None
+        95% bootstrap interval of `ratio`
+    sufficient : bool
+        the sample counts can reach a p-value below `alpha`
+    significant : bool
+        pvalue below `alpha`
+    changed : bool
+        significant and at least `MIN_CHANGE` away from a ratio of 1
+    """
+    def __init__(self, key, baseline, current, alpha=0.05):
+        if not baseline or not current:
+            raise ValueError('comparison needs baseline and current samples')
+        self.key = key
+        self.baseline = baseline
+        self.current = current
+        self.alpha = alpha
+        self.baseline_median = _stats.median(baseline)
+        self.current_median = _stats.median(current)
+        self.ratio = (float(self.current_median) / self.baseline_median
+                      if self.baseline_median else float('inf'))
+
+        if len(current) > 1 and len(baseline) > 1:
+            self.pvalue = _stats.mann_whitney(current, baseline)[1]
+            self.interval = _stats.bootstrap_ratio(baseline, current)
+        else:
+            value = current[0] if len(current) == 1 else baseline[0]
+            others = baseline if len(current) == 1 else current
+            above = sum(1 for other in others if other >= value)
+            below = sum(1 for other in others if other <= value)
+            self.pvalue = min(1.0, 2.0 * (min(above, below) + 1) / (len(others) + 1))
+            self.interval = None
+        self.sufficient = min_pvalue(len(baseline), len(current)) < alpha
+        self.significant = self.pvalue < alpha
+        self.changed = self.significant and abs(self.ratio - 1) >= MIN_CHANGE
+
+    def _qualifier(self):
+        if not self.sufficient:
+            return 'insufficient samples for p<{:g}'.format(self.alpha)
+        return None
+
+    @property
+    def verdict(self):
+        """e.g. '2.3x slower', '1.4x faster' or 'no significant change'"""
+        if not self.changed:
+            return 'no significant change'
+        if self.ratio >= 1:
+            return '{:.3g}x slower'.format(self.ratio)
+        return '{:.3g}x faster'.format(1 / self.ratio if self.ratio else float('inf'))
+
+    def __repr__(self):
+        text = '{}, {}'.format(self.verdict, _stats.format_pvalue(self.pvalue))
+        if self._qualifier():
+            text += ' ({})'.format(self._qualifier())
+        details = ['baseline {} (n={})'.format(_stats.format_duration(self.baseline_median), len(self.baseline)),
+                   'now {} (n={})'.format(_stats.format_duration(self.current_median), len(self.current))]
+        if self.interval:
+            details.append('95% CI {:.2f}x-{:.2f}x'.format(*self.interval))
+        return '{}: {} [{}]'.format(self.key, text, '; '.join(details))
+
+    def _repr_html_(self):
+        color = '#b00' if self.changed and self.ratio > 1 else '#070' if self.changed else '#555'
+        rows = [
+            ('baseline median', '{} (n={})'.format(_stats.format_duration(self.baseline_median), len(self.baseline))),
+            ('current median', '{} (n={})'.format(_stats.format_duration(self.current_median), len(self.current))),
+            ('95% CI of ratio', '{:.2f}x - {:.2f}x'.format(*self.interval) if self.interval else 'n/a'),
+        ]
+        body = ''.join('<tr><th style="text-align:left;">{}</th><td>{}</td></tr>'.format(*row) for row in rows)
+        return """
+            <table class="ipytools-baseline">
+                <caption>{key}: <b style="color:{color};">{verdict}, {p}</b>{qualifier}</caption>
+                <tbody>{body}</tbody>
+            </table>
+        """.format(key=escape(self.key), color=color, verdict=self.verdict,
+                   p=_stats.format_pvalue(self.pvalue), body=body,
+                   qualifier=' ({})'.format(self._qualifier()) if self._qualifier() else '')
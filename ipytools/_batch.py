@@ -0,0 +1,337 @@
+"""`ipytools-export`: convert many notebooks outside a kernel
+
+Every (notebook, format, template) combination is one job.  Jobs run on a
+bounded `multiprocessing.Pool`; each worker keeps `_export`'s exporter
+cache, so a template is compiled once per worker instead of once per
+notebook.  A failing notebook is reported and counted but does not stop
+the others; a notebook still converting after the timeout has its worker
+killed and is reported as failed.
+
+Example
+-------
+$ ipytools-export 'reports/**/*.ipynb' --to html --to slides -j 8 -o build
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+
+
+from . import _clocks, _export
+from ._stats import format_duration
+
+# the ipytools template used for a format when --template is not given
+DEFAULT_TEMPLATES = {'html': 'html_output.tpl', 'slides': 'slides_reveal.tpl'}
+FORMATS = ['custom', 'html', 'latex', 'markdown', 'notebook', 'pdf', 'python', 'rst', 'script', 'slides']
+
+# in each worker: shared arrays of the pid and start time of every job
+_started = [None]
+
+
+def _glob(pattern):
+    try:
+        return glob.glob(pattern, recursive=True)
+    except TypeError:
+        # Python 2: no `**`
+        return glob.glob(pattern)
+
+
+def find_notebooks(patterns):
+    """notebook paths matching `patterns`, in order and without duplicates
+
+    Directories expand to the notebooks directly inside them; checkpoint
+    copies are skipped.
+    """
+    found, seen = [], set()
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.ipynb')
+        for path in sorted(_glob(pattern)):
+            if '.ipynb_checkpoints' in path.split(os.sep) or not path.endswith('.ipynb'):
+                continue
+            path = os.path.normpath(path)
+            if path not in seen:
+                seen.add(path)
+                found.append(path)
+    return found
+
+
+def _template(to, template, template_dir):
+    if template == 'default':
+        return None
+    if template is None:
+        template = DEFAULT_TEMPLATES.get(to)
+        if template and not os.path.exists(os.path.join(os.path.expanduser(template_dir), template)):
+            return None
+    return template
+
+
+def plan(notebooks, formats, templates, template_dir=_export.TEMPLATE_DIR, output_dir=None):
+    """one job dict per (notebook, format, template)
+
+    Outputs go next to each notebook unless `output_dir` is given, in which
+    case each notebook keeps its directory relative to the deepest directory
+    holding all of them, so /data/a/report.ipynb and /data/b/report.ipynb
+    become `output_dir`/a/report.html and `output_dir`/b/report.html.  With
+    several templates each one writes to its own subdirectory so their
+    outputs do not overwrite each other.
+    """
+    if output_dir is not None and notebooks:
+        directories = [os.path.dirname(os.path.abspath(path)) + os.sep for path in notebooks]
+        common = os.path.dirname(os.path.commonprefix(directories))
+    jobs = []
+    for path in notebooks:
+        for to in formats:
+            for template in templates:
+                directory = os.path.dirname(path)
+                if output_dir is not None:
+                    relative = os.path.relpath(os.path.dirname(os.path.abspath(path)), common)
+                    directory = os.path.normpath(os.path.join(output_dir, relative))
+                if len(templates) > 1:
+                    directory = os.path.join(directory, os.path.splitext(template or 'auto')[0])
+                jobs.append({
+                    'path': path,
+                    'to': to,
+                    'template': _template(to, template, template_dir),
+                    'template_dir': template_dir,
+                    'build_directory': directory,
+                })
+    return jobs
+
+
+def convert(job):
+    """run one job, returning it with `output`, `error` and `ns` filled in
+
+    Never raises: the error and its traceback are returned instead, so one
+    bad notebook cannot take down the pool.
+    """
+    result = dict(job, output=None, error=None, traceback=None)
+    start = _clocks.wall_ns()
+    try:
+        if job['build_directory'] and not os.path.isdir(job['build_directory']):
+            try:
+                os.makedirs(job['build_directory'])
+            except OSError:
+                # another worker created it first
+                if not os.path.isdir(job['build_directory']):
+                    raise
+        result['output'] = _export.export_notebook(
+            job['path'], to=job['to'], template=job['template'],
+            template_dir=job['template_dir'], build_directory=job['build_directory'])
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    result['ns'] = _clocks.wall_ns() - start
+    return result
+
+
+def _failed(job, error, ns=None):
+    return dict(job, output=None, error=error, traceback=None, ns=ns)
+
+
+def _init_worker(pids, since):
+    _started[0] = pids, since
+
+
+def _convert_indexed(index, job):
+    pids, since = _started[0]
+    # shared memory, so the parent sees it even if this worker dies next
+    pids[index] = os.getpid()
+    since[index] = time.time()
+    return index, convert(job)
+
+
+def _signal(pid, signum):
+    """True when `pid` exists and got `signum`"""
+    try:
+        os.kill(pid, signum)
+    except OSError:
+        return False
+    return True
+
+
+def run(jobs, processes=None, callback=None, timeout=None):
+    """convert `jobs` on a pool of `processes` workers (default: one per core)
+
+    `callback` is called with each result as it completes.  Returns the
+    results in completion order.  With `processes=1` and no `timeout` jobs
+    run in this process, which is easier to debug.
+
+    A job still running `timeout` seconds after its worker picked it up
+    has that worker killed and is returned as failed; the pool replaces
+    the worker and the other jobs carry on.  A worker that dies mid-job
+    fails only that job.  Jobs no worker picks up for
+    `timeout` seconds while none is running are returned as not run, with
+    `ns` None.
+    """
+    processes = min(processes or multiprocessing.cpu_count(), len(jobs)) or 1
+    callback = callback or (lambda result: None)
+    results = []
+    if processes == 1 and timeout is None:
+        for job in jobs:
+            results.append(convert(job))
+            callback(results[-1])
+        return results
+
+    pids = multiprocessing.Array('l', len(jobs), lock=False)
+    since = multiprocessing.Array('d', len(jobs), lock=False)
+    pool = multiprocessing.Pool(processes, _init_worker, (pids, since))
+    killed = False
+    try:
+        waiting = dict((index, pool.apply_async(_convert_indexed, (index, job)))
+                       for index, job in enumerate(jobs))
+        dead = {}
+        active = time.time()
+        while waiting:
+            now = time.time()
+            running = False
+            for index in sorted(waiting):
+                if waiting[index].ready():
+                    result = waiting.pop(index).get()[1]
+                elif not pids[index]:
+                    continue
+                elif not _signal(pids[index], 0) and now - dead.setdefault(index, now) > 1:
+                    # gone without a result, e.g. a crash in a C extension
+                    del waiting[index]
+                    killed = True
+                    result = _failed(jobs[index], 'worker {} died while converting'.format(pids[index]),
+                                     int((dead[index] - since[index]) * 1e9))
+                elif timeout is not None and now - since[index] > timeout:
+                    _signal(pids[index], getattr(signal, 'SIGKILL', signal.SIGTERM))
+                    del waiting[index]
+                    killed = True
+                    result = _failed(jobs[index], 'TimeoutError: still running after {:g}s, worker killed'.format(
+                        timeout), int((now - since[index]) * 1e9))
+                else:
+                    running = True
+                    continue
+                active = now
+                results.append(result)
+                callback(result)
+            if timeout is not None and waiting and not running and now - active > timeout:
+                # no worker left to pick them up
+                for index in sorted(waiting):
+                    results.append(_failed(jobs[index], 'not run: no worker picked it up within {:g}s'.format(timeout)))
+                    callback(results[-1])
+                killed = True
+                break
+            time.sleep(0.05)
+        if killed:
+            # results of killed workers never arrive; close() would wait for them
+            pool.terminate()
+        else:
+            pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def _status(result):
+    if result['ns'] is None:
+        return 'NOT RUN'
+    return 'FAILED' if result['error'] else 'ok'
+
+
+class BatchReport(object):
+    """Per-job timings and the outcome of an `ipytools-export` run"""
+    def __init__(self, results, wall_ns, processes):
+        self.results = sorted(results, key=lambda result: -1 if result['ns'] is None else result['ns'], reverse=True)
+        self.wall_ns = wall_ns
+        self.processes = processes
+        self.failed = [result for result in self.results if result['error']]
+        self.not_run = [result for result in self.failed if result['ns'] is None]
+
+    def __repr__(self):
+        total_ns = sum(result['ns'] or 0 for result in self.results)
+        lines = ['{:>10} | {:>7} | {:<8} | {:<18} | {}'.format('time', 'status', 'format', 'template', 'notebook')]
+        for result in self.results:
+            lines.append('{:>10} | {:>7} | {:<8} | {:<18} | {}'.format(
+                '-' if result['ns'] is None else format_duration(result['ns']), _status(result),
+                result['to'], result['template'] or '-', result['path']))
+        lines.append('')
+        lines.append('{} converted, {} failed, {} not run in {} on {} worker(s) ({} of conversion time)'.format(
+            len(self.results) - len(self.failed), len(self.failed) - len(self.not_run), len(self.not_run),
+            format_duration(self.wall_ns), self.processes, format_duration(total_ns)))
+        for result in self.failed:
+            lines.append('')
+            lines.append('{} ({}): {}'.format(result['path'], result['to'], result['error']))
+        return '\n'.join(lines)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='ipytools-export',
+        description='Convert notebooks with nbconvert and the ipytools templates, in parallel.')
+    parser.add_argument('notebooks', nargs='+', metavar='NOTEBOOK',
+                        help="notebook, directory or glob; quote globs such as 'reports/**/*.ipynb'")
+    parser.add_argument('--to', action='append', choices=FORMATS,
+                        help='output format, repeatable (default: html)')
+    parser.add_argument('-t', '--template', action='append',
+                        help="template, repeatable; 'default' uses nbconvert's own "
+                             "(default: the ipytools template for the format, if installed)")
+    parser.add_argument('--template-dir', default=_export.TEMPLATE_DIR,
+                        help='directory searched for templates (default: %(default)s)')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='write outputs here instead of next to each notebook')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='kill the worker of a notebook still converting after this many '
+                             'seconds and report it as failed (default: %(default)s)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print the summary')
+    parser.add_argument('--traceback', action='store_true',
+                        help='print full tracebacks for failed notebooks')
+    return parser
+
+
+def main(argv=None):
+    """entry point of `ipytools-export`; returns 1 if any conversion failed"""
+    args = _parser().parse_args(argv)
+    if not _export.available():
+        sys.stderr.write('ipytools-export: nbconvert is not installed\n')
+        return 2
+    if args.jobs is not None and args.jobs < 1:
+        sys.stderr.write('ipytools-export: --jobs must be at least 1\n')
+        return 2
+    if args.timeout <= 0:
+        sys.stderr.write('ipytools-export: --timeout must be positive\n')
+        return 2
+
+    notebooks = find_notebooks(args.notebooks)
+    if not notebooks:
+        sys.stderr.write('ipytools-export: no notebooks match {}\n'.format(' '.join(args.notebooks)))
+        return 2
+    jobs = plan(notebooks, args.to or ['html'], args.template or [None],
+                template_dir=args.template_dir, output_dir=args.output_dir)
+    processes = min(args.jobs or multiprocessing.cpu_count(), len(jobs))
+
+    done = [0]
+
+    def progress(result):
+        done[0] += 1
+        if not args.quiet:
+            status = format_duration(result['ns']) if _status(result) == 'ok' else _status(result)
+            sys.stdout.write('[{}/{}] {} ({}) {}\n'.format(done[0], len(jobs), result['path'], result['to'], status))
+            sys.stdout.flush()
+
+    start = _clocks.wall_ns()
+    results = run(jobs, processes, callback=progress, timeout=args.timeout)
+    report = BatchReport(results, _clocks.wall_ns() - start, processes)
+    sys.stdout.write('\n{!r}\n'.format(report))
+    if args.traceback:
+        for result in report.failed:
+            sys.stdout.write('\n{}'.format(result['traceback']))
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
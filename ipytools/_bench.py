@@ -0,0 +1,369 @@
+"""Statistical benchmark mode behind `Timer.bench`, `%%bench` and `%%abtest`"""
+import ast, gc, itertools, random
+
+from . import _baseline, _clocks, _stats
+from ._html import escape
+
+_CALIBRATION_STEPS = (1, 2, 5)
+
+# the statement is spliced into the `for` body, as `timeit` does
+_LOOP_TEMPLATE = """
+def _ipytools_loop(_ipytools_number, _ipytools_clock=_ipytools_clock, _ipytools_repeat=_ipytools_repeat):
+    _ipytools_start = _ipytools_clock()
+    for _ipytools_i in _ipytools_repeat(None, _ipytools_number):
+        pass
+    return _ipytools_clock() - _ipytools_start
+"""
+
+
+class StatementLoop(object):
+    """code compiled into a timing loop, like `timeit` does with its statement
+
+    Timing a statement through a function that `eval`s it would add the
+    call and `eval` overhead to every loop; here the statement is the loop
+    body, so a sample costs one clock read at each end.  Names assigned by
+    the statement are local to the loop, as with `timeit`.
+
+    Parameters
+    ----------
+    source : str
+        Python statements
+    namespace : dict
+        globals the statements run in, e.g. the IPython user namespace
+    filename : str
+        name shown in tracebacks
+    compiler : callable
+        `compile`-like function, e.g. an IPython shell's `compile`
+    """
+    def __init__(self, source, namespace, filename='<bench>', compiler=compile):
+        tree = ast.parse(_LOOP_TEMPLATE)
+        for node in ast.walk(tree):
+            # keep line numbers increasing into the statement, or Python 2
+            # tracebacks point at the wrong line
+            if hasattr(node, 'lineno'):
+                node.lineno = 1
+        body = ast.parse(source, filename).body
+        if body:
+            tree.body[0].body[1].body = body
+        local = {'_ipytools_clock': _clocks.wall_ns, '_ipytools_repeat': itertools.repeat}
+        exec(compiler(ast.fix_missing_locations(tree), filename, 'exec'), namespace, local)
+        self.loop = local['_ipytools_loop']
+        self.__name__ = filename
+
+    def __call__(self):
+        self.loop(1)
+
+
+def _time_loops(func, args, kwargs, number):
+    """run `func` `number` times and return the elapsed wall time in ns"""
+    if isinstance(func, StatementLoop):
+        return func.loop(number)
+    loops = itertools.repeat(None, number)
+    clock = _clocks.wall_ns
+    start = clock()
+    for _ in loops:
+        func(*args, **kwargs)
+    return clock() - start
+
+
+def calibrate(func, args=(), kwargs=None, target=0.02):
+    """find a loop count whose batch runtime reaches `target` seconds
+
+    Loop counts follow the 1, 2, 5, 10, 20, 50, ... sequence used by
+    `timeit.Timer.autorange`.
+
+    Parameters
+    ----------
+    func : callable
+        function to benchmark
+    args : tuple
+        positional arguments for `func`
+    kwargs : dict
+        keyword arguments for `func`
+    target : float
+        minimum batch runtime in seconds
+
+    Returns
+    -------
+    number : int
+        loops per sample
+    """
+    kwargs = kwargs or {}
+    target_ns = target * _clocks.NS_PER_SECOND
+    scale = 1
+    while True:
+        for step in _CALIBRATION_STEPS:
+            number = step * scale
+            if _time_loops(func, args, kwargs, number) >= target_ns:
+                return number
+        scale *= 10
+
+
+def bench(func, args=(), kwargs=None, number=None, repeat=20, warmup=1,
+          target=0.02, name=None, disable_gc=True):
+    """benchmark `func` with auto-calibrated loops and repeated samples
+
+    Parameters
+    ----------
+    func : callable
+        function to benchmark
+    args : tuple
+        positional arguments for `func`
+    kwargs : dict
+        keyword arguments for `func`
+    number : int, optional
+        loops per sample; calibrated to `target` seconds when None
+    repeat : int
+        number of samples to collect
+    warmup : int
+        number of discarded samples run before measuring
+    target : float
+        calibration target per sample, in seconds
+    name : str, optional
+        label used in reports, defaults to the function name
+    disable_gc : bool
+        disable the garbage collector while sampling, like `timeit`
+
+    Returns
+    -------
+    result : BenchResult
+    """
+    kwargs = kwargs or {}
+    if repeat < 1:
+        raise ValueError('repeat must be at least 1')
+    name = name or getattr(func, '__name__', repr(func))
+
+    gc_enabled = gc.isenabled()
+    if disable_gc:
+        gc.disable()
+    try:
+        if number is None:
+            number = calibrate(func, args, kwargs, target)
+        for _ in range(warmup):
+            _time_loops(func, args, kwargs, number)
+        samples = [float(_time_loops(func, args, kwargs, number)) / number
+                   for _ in range(repeat)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return BenchResult(name, samples, number, warmup)
+
+
+class BenchResult(object):
+    """Structured result of a benchmark run
+
+    Attributes
+    ----------
+    name : str
+        benchmark label
+    samples : list
+        per-loop wall time of each sample, in nanoseconds
+    number : int
+        loops per sample
+    warmup : int
+        discarded warmup samples
+    stats : dict
+        min, max, median, mean, stddev, p95, p99 (ns) and outlier counts
+
+    Example
+    -------
+    >>> result = Timer.bench(sorted, args=(range(1000),))
+    >>> hdisplay(result)
+    """
+    _rows = [
+        ('min', 'min'),
+        ('median', 'median'),
+        ('mean', 'mean'),
+        ('stddev', 'std dev'),
+        ('p95', 'p95'),
+        ('p99', 'p99'),
+        ('max', 'max'),
+    ]
+
+    def __init__(self, name, samples, number, warmup=0):
+        self.name = name
+        self.samples = samples
+        self.number = number
+        self.warmup = warmup
+        self.stats = _stats.summarize(samples)
+
+    @property
+    def repeat(self):
+        return len(self.samples)
+
+    def __getattr__(self, name):
+        stats = self.__dict__.get('stats', {})
+        if name in stats:
+            return stats[name]
+        raise AttributeError(name)
+
+    def save_baseline(self, key):
+        """store these samples as the baseline `key`, replacing older ones
+
+        Returns
+        -------
+        path : str
+            baseline file
+        """
+        return _baseline.save(key, self.samples, meta={'name': self.name, 'number': self.number})
+
+    def compare_baseline(self, key, alpha=0.05):
+        """compare these samples with the baseline `key`
+
+        Returns
+        -------
+        comparison : Comparison
+            e.g. '2.3x slower, p<0.01'
+        """
+        return _baseline.compare(key, self.samples, alpha=alpha)
+
+    def _outlier_text(self):
+        return '{} mild, {} severe outliers'.format(
+            self.stats['mild_outliers'], self.stats['severe_outliers'])
+
+    def __repr__(self):
+        values = ['{} {}'.format(label, _stats.format_duration(self.stats[key]))
+                  for key, label in self._rows]
+        return '{}: {} ({} runs x {} loops, {})'.format(
+            self.name, ', '.join(values), self.repeat, self.number,
+            self._outlier_text())
+
+    def _repr_html_(self):
+        rows = ''.join(
+            '<tr><th style="text-align:left;">{}</th><td>{}</td></tr>'.format(
+                label, _stats.format_duration(self.stats[key]))
+            for key, label in self._rows)
+        return """
+            <table class="ipytools-bench">
+                <caption>{name}</caption>
+                <thead><tr><th></th><th>per loop</th></tr></thead>
+                <tbody>{rows}</tbody>
+                <tfoot><tr><td colspan="2">{repeat} runs x {number} loops, {warmup} warmup; {outliers}</td></tr></tfoot>
+            </table>
+        """.format(name=escape(self.name), rows=rows, repeat=self.repeat,
+                   number=self.number, warmup=self.warmup,
+                   outliers=self._outlier_text())
+
+
+def abtest(func_a, func_b, rounds=30, number=None, warmup=1, target=0.02,
+           names=('A', 'B'), seed=None, disable_gc=True):
+    """compare two functions sampled in interleaved, randomized order
+
+    Each round times one batch of `func_a` and one of `func_b` in a random
+    order, so cache warmth and clock or thermal drift affect both variants
+    alike instead of biasing whichever ran second.
+
+    Parameters
+    ----------
+    func_a, func_b : callable
+        zero-argument variants; `func_a` is the reference
+    rounds : int
+        samples collected per variant
+    number : int, optional
+        loops per sample, shared by both variants; calibrated so the slower
+        variant reaches `target` seconds when None
+    warmup : int
+        discarded rounds run before measuring
+    target : float
+        calibration target per sample, in seconds
+    names : tuple
+        labels of the two variants
+    seed : int, optional
+        seed for the round order
+    disable_gc : bool
+        disable the garbage collector while sampling
+
+    Returns
+    -------
+    result : ABResult
+    """
+    if rounds < 2:
+        raise ValueError('rounds must be at least 2')
+    rng = random.Random(seed)
+    variants = [func_a, func_b]
+    samples = [[], []]
+
+    gc_enabled = gc.isenabled()
+    if disable_gc:
+        gc.disable()
+    try:
+        if number is None:
+            number = min(calibrate(func, target=target) for func in variants)
+        for round_ in range(warmup + rounds):
+            order = [0, 1]
+            rng.shuffle(order)
+            for index in order:
+                elapsed = _time_loops(variants[index], (), {}, number)
+                if round_ >= warmup:
+                    samples[index].append(float(elapsed) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return ABResult(BenchResult(names[0], samples[0], number, warmup),
+                    BenchResult(names[1], samples[1], number, warmup))
+
+
+class ABResult(object):
+    """Outcome of an interleaved A/B benchmark
+
+    Attributes
+    ----------
+    a, b : BenchResult
+        per-variant samples and statistics
+    speedup : float
+        median(a) / median(b); above 1 means B is faster
+    interval : tuple
+        95% bootstrap interval of `speedup`
+    pvalue : float
+        two-sided Mann-Whitney U test of the two sample sets
+
+    Example
+    -------
+    >>> result = Timer.abtest(lambda: sorted(data), lambda: data.sort())
+    >>> hdisplay(result)
+    """
+    def __init__(self, a, b, alpha=0.05):
+        self.a = a
+        self.b = b
+        self.speedup = float(a.median) / b.median if b.median else float('inf')
+        self.interval = _stats.bootstrap_ratio(b.samples, a.samples)
+        self.pvalue = _stats.mann_whitney(a.samples, b.samples)[1]
+        self.significant = self.pvalue < alpha
+
+    @property
+    def verdict(self):
+        """e.g. 'B is 1.8x faster than A'"""
+        if self.speedup >= 1:
+            return '{} is {:.3g}x faster than {}'.format(self.b.name, self.speedup, self.a.name)
+        return '{} is {:.3g}x slower than {}'.format(
+            self.b.name, 1 / self.speedup if self.speedup else float('inf'), self.a.name)
+
+    def _summary(self):
+        low, high = self.interval
+        if self.speedup < 1:
+            low, high = 1 / high if high else float('inf'), 1 / low if low else float('inf')
+        text = '{} (95% CI {:.2f}x-{:.2f}x, {})'.format(
+            self.verdict, low, high, _stats.format_pvalue(self.pvalue))
+        if not self.significant:
+            text += ', not significant'
+        return text
+
+    def __repr__(self):
+        return '\n'.join([self._summary(), repr(self.a), repr(self.b)])
+
+    def _repr_html_(self):
+        color = '#555' if not self.significant else '#070' if self.speedup >= 1 else '#b00'
+        return """
+            <div class="ipytools-abtest">
+                <p><b style="color:{color};">{summary}</b></p>
+                <div style="display:flex;gap:2em;">
+                    <div>{a}</div>
+                    <div>{b}</div>
+                </div>
+                <p>speedup = median({a_name}) / median({b_name}); {rounds} interleaved rounds in random order</p>
+            </div>
+        """.format(color=color, summary=escape(self._summary()), a=self.a._repr_html_(),
+                   b=self.b._repr_html_(), a_name=escape(self.a.name), b_name=escape(self.b.name),
+                   rounds=self.a.repeat)
@@ -0,0 +1,78 @@
+"""Clock sources used by `Timer`
+
+Every clock returns an integer number of nanoseconds.  The best clock the
+interpreter offers is chosen at import time:
+
+    wall_ns    : perf_counter_ns > perf_counter > time.time
+    process_ns : process_time_ns > process_time > getrusage(RUSAGE_SELF) > clock
+    thread_ns  : thread_time_ns > thread_time > getrusage(RUSAGE_THREAD) > None
+
+`thread_ns` is None when the platform has no per-thread CPU clock.
+"""
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+NS_PER_SECOND = 10 ** 9
+
+
+def _seconds_to_ns(func):
+    def clock():
+        return int(func() * NS_PER_SECOND)
+    return clock
+
+
+def _rusage_ns(who):
+    def clock():
+        usage = resource.getrusage(who)
+        return int((usage.ru_utime + usage.ru_stime) * NS_PER_SECOND)
+    return clock
+
+
+if hasattr(time, 'perf_counter_ns'):
+    wall_ns = time.perf_counter_ns
+elif hasattr(time, 'perf_counter'):
+    wall_ns = _seconds_to_ns(time.perf_counter)
+else:
+    wall_ns = _seconds_to_ns(time.time)
+
+if hasattr(time, 'process_time_ns'):
+    process_ns = time.process_time_ns
+elif hasattr(time, 'process_time'):
+    process_ns = _seconds_to_ns(time.process_time)
+elif resource is not None:
+    process_ns = _rusage_ns(resource.RUSAGE_SELF)
+else:
+    process_ns = _seconds_to_ns(time.clock)
+
+if hasattr(time, 'thread_time_ns'):
+    thread_ns = time.thread_time_ns
+elif hasattr(time, 'thread_time'):
+    thread_ns = _seconds_to_ns(time.thread_time)
+elif resource is not None and hasattr(resource, 'RUSAGE_THREAD'):
+    thread_ns = _rusage_ns(resource.RUSAGE_THREAD)
+else:
+    thread_ns = None
+
+
+def format_ns(ns):
+    """format a nanosecond count as seconds without float rounding
+
+    Parameters
+    ----------
+    ns : int
+        duration in nanoseconds
+
+    Returns
+    -------
+    string : str
+        e.g. '1.002276123s'
+    """
+    if ns is None:
+        return 'n/a'
+    sign = '-' if ns < 0 else ''
+    seconds, nanoseconds = divmod(abs(ns), NS_PER_SECOND)
+    return '{}{}.{:0>9d}s'.format(sign, seconds, nanoseconds)
@@ -0,0 +1,219 @@
+"""Collect `Timer` spans measured in worker processes
+
+While a TimerCollector is active, every Timer that finishes in a child
+process puts one small tuple on a multiprocessing queue.  Forked workers
+inherit the collector automatically; pools using the spawn or forkserver
+start methods pass `collector.initializer` / `collector.initargs`.
+"""
+import os
+
+from . import _stats
+from ._html import escape
+from ._stats import format_duration
+
+_sink = [None]
+
+
+def _install(queue, parent_pid):
+    """pool initializer: report spans of this worker into `queue`"""
+    _sink[0] = (queue, parent_pid)
+
+
+def report(name, path, start_ns, wall_ns, process_ns):
+    """forward one finished span to the active collector, if any"""
+    sink = _sink[0]
+    if sink is None:
+        return
+    pid = os.getpid()
+    if pid != sink[1]:
+        sink[0].put((pid, name, ';' not in path, start_ns, wall_ns, process_ns))
+
+
+class TimerCollector(object):
+    """Context manager aggregating Timer spans reported by worker processes
+
+    Close and join the pool before leaving the block so workers flush their
+    queues; a terminated worker loses the spans it has not sent yet.
+
+    Example
+    -------
+    >>> def work(chunk):
+    ...     with Timer('score'):
+    ...         return model.predict(chunk)
+    ...
+    >>> with TimerCollector() as collector:
+    ...     pool = multiprocessing.Pool(8, collector.initializer, collector.initargs)
+    ...     results = pool.map(work, chunks)
+    ...     pool.close()
+    ...     pool.join()
+    ...
+    >>> hdisplay(collector.report())
+    """
+    initializer = staticmethod(_install)
+
+    def __init__(self, context=None):
+        import multiprocessing
+        context = context or multiprocessing
+        self.queue = context.Queue()
+        self.parent_pid = os.getpid()
+        self.spans = []
+
+    @property
+    def initargs(self):
+        return (self.queue, self.parent_pid)
+
+    def __enter__(self):
+        self._previous = _sink[0]
+        _install(self.queue, self.parent_pid)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.drain()
+        _sink[0] = self._previous
+
+    def drain(self, timeout=0.1):
+        """move every queued span into `spans`
+
+        Parameters
+        ----------
+        timeout : float
+            seconds to wait for late spans once the queue looks empty
+        """
+        try:
+            from Queue import Empty
+        except ImportError:
+            from queue import Empty
+        while True:
+            try:
+                self.spans.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return len(self.spans)
+
+    def report(self):
+        """summarize the spans collected so far
+
+        Returns
+        -------
+        report : CollectorReport
+        """
+        self.drain()
+        return CollectorReport(self.spans)
+
+
+class CollectorReport(object):
+    """Per-worker and per-span statistics of collected Timer spans
+
+    Attributes
+    ----------
+    workers : list
+        one dict per pid: spans, busy_ns (top-level spans only), cpu_ns,
+        first start, last end
+    names : list
+        one dict per span name with count and duration statistics
+    imbalance : float
+        busiest worker's busy time over the mean busy time; 1.0 is balanced
+    efficiency : float
+        summed busy time over workers x elapsed time; 1.0 is linear scaling
+    stragglers : list
+        pids whose busy time exceeds the median by more than half
+    slow_spans : list
+        spans longer than their name's median plus 3 scaled MADs
+    """
+    def __init__(self, spans):
+        self.spans = spans
+        workers = {}
+        by_name = {}
+        for pid, name, top, start, wall, cpu in spans:
+            worker = workers.setdefault(pid, {
+                'pid': pid, 'spans': 0, 'busy_ns': 0, 'cpu_ns': 0,
+                'start_ns': start, 'end_ns': start + wall})
+            worker['spans'] += 1
+            if top:
+                worker['busy_ns'] += wall
+                worker['cpu_ns'] += cpu
+            worker['start_ns'] = min(worker['start_ns'], start)
+            worker['end_ns'] = max(worker['end_ns'], start + wall)
+            by_name.setdefault(name, []).append((wall, pid))
+
+        self.workers = sorted(workers.values(), key=lambda worker: worker['pid'])
+        busy = [worker['busy_ns'] for worker in self.workers]
+        if busy and _stats.mean(busy):
+            self.imbalance = max(busy) / _stats.mean(busy)
+            elapsed = (max(worker['end_ns'] for worker in self.workers) -
+                       min(worker['start_ns'] for worker in self.workers))
+            self.efficiency = float(sum(busy)) / (len(busy) * elapsed) if elapsed else 1.0
+            median_busy = _stats.median(busy)
+            self.stragglers = [worker['pid'] for worker in self.workers
+                               if worker['busy_ns'] > 1.5 * median_busy]
+        else:
+            self.imbalance = self.efficiency = None
+            self.stragglers = []
+
+        self.names = []
+        self.slow_spans = []
+        for name, runs in sorted(by_name.items()):
+            walls = sorted(wall for wall, _ in runs)
+            summary = _stats.summarize(walls)
+            summary.update({'name': name, 'count': len(walls), 'total_ns': sum(walls),
+                            'workers': len(set(pid for _, pid in runs))})
+            self.names.append(summary)
+            median = summary['median']
+            mad = _stats.median([abs(wall - median) for wall in walls])
+            limit = median + 3 * 1.4826 * mad
+            if mad:
+                self.slow_spans.extend((name, pid, wall) for wall, pid in runs if wall > limit)
+        self.names.sort(key=lambda summary: summary['total_ns'], reverse=True)
+        self.slow_spans.sort(key=lambda span: span[2], reverse=True)
+
+    def _summary(self):
+        if self.imbalance is None:
+            return 'no spans collected'
+        text = '{} spans from {} workers; imbalance {:.2f}x, parallel efficiency {:.0%}'.format(
+            len(self.spans), len(self.workers), self.imbalance, self.efficiency)
+        if self.stragglers:
+            text += '; stragglers: {}'.format(', '.join('pid {}'.format(pid) for pid in self.stragglers))
+        return text
+
+    def __repr__(self):
+        lines = [self._summary(), '{:>8}{:>8}{:>12}{:>12}'.format('pid', 'spans', 'busy', 'cpu')]
+        for worker in self.workers:
+            lines.append('{:>8}{:>8}{:>12}{:>12}'.format(
+                worker['pid'], worker['spans'], format_duration(worker['busy_ns']),
+                format_duration(worker['cpu_ns'])))
+        lines.append('{:<30}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('span', 'count', 'total', 'median', 'p95', 'max'))
+        for summary in self.names:
+            lines.append('{:<30}{:>8}{:>12}{:>12}{:>12}{:>12}'.format(
+                summary['name'], summary['count'], format_duration(summary['total_ns']),
+                format_duration(summary['median']), format_duration(summary['p95']),
+                format_duration(summary['max'])))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _table(headers, rows):
+        head = ''.join('<th>{}</th>'.format(header) for header in headers)
+        body = ''.join('<tr>{}</tr>'.format(''.join('<td>{}</td>'.format(cell) for cell in row)) for row in rows)
+        return '<table><thead><tr>{}</tr></thead><tbody>{}</tbody></table>'.format(head, body)
+
+    def _repr_html_(self):
+        busiest = max([worker['busy_ns'] for worker in self.workers] or [0])
+        bar = '<div style="background:#4a90d9;height:10px;width:{}px;"></div>'
+        workers = self._table(
+            ['pid', 'spans', 'busy', 'cpu', 'load'],
+            [[worker['pid'], worker['spans'], format_duration(worker['busy_ns']),
+              format_duration(worker['cpu_ns']),
+              bar.format(int(150.0 * worker['busy_ns'] / busiest) if busiest else 0)]
+             for worker in self.workers])
+        names = self._table(
+            ['span', 'count', 'workers', 'total', 'median', 'p95', 'max'],
+            [[escape(summary['name']), summary['count'], summary['workers'],
+              format_duration(summary['total_ns']), format_duration(summary['median']),
+              format_duration(summary['p95']), format_duration(summary['max'])]
+             for summary in self.names])
+        slow = ''
+        if self.slow_spans:
+            slow = '<p>Slow spans: {}</p>'.format(', '.join(
+                '{} in pid {} ({})'.format(escape(name), pid, format_duration(wall))
+                for name, pid, wall in self.slow_spans[:10]))
+        return '<div class="ipytools-collector"><p><b>{}</b></p>{}{}{}</div>'.format(
+            self._summary(), workers, names, slow)
@@ -0,0 +1,174 @@
+"""Deterministic profiling results rendered as a sortable HTML table"""
+import cProfile
+import os
+import pstats
+import random
+
+from ._html import escape
+
+_SORT_KEYS = {
+    'cumulative': 'cumtime',
+    'tottime': 'tottime',
+    'ncalls': 'ncalls',
+}
+
+_script = """
+<script>
+(function() {
+  var table = document.getElementById('%(uid)s');
+  var headers = table.tHead.rows[0].cells;
+  for (var i = 0; i < headers.length; i++) {
+    (function(column) {
+      var descending = true;
+      headers[column].style.cursor = 'pointer';
+      headers[column].onclick = function() {
+        var body = table.tBodies[0];
+        var rows = Array.prototype.slice.call(body.rows);
+        rows.sort(function(a, b) {
+          var x = a.cells[column].getAttribute('data-value');
+          var y = b.cells[column].getAttribute('data-value');
+          var nx = parseFloat(x), ny = parseFloat(y);
+          var order = isNaN(nx) || isNaN(ny) ? (x < y ? -1 : x > y ? 1 : 0) : nx - ny;
+          return descending ? -order : order;
+        });
+        descending = !descending;
+        for (var r = 0; r < rows.length; r++) { body.appendChild(rows[r]); }
+      };
+    })(i);
+  }
+})();
+</script>
+"""
+
+
+def func_label(func):
+    """'name (file:line)' for a pstats function key"""
+    filename, lineno, name = func
+    if filename == '~':
+        return name
+    return '{} ({}:{})'.format(name, os.path.basename(filename), lineno)
+
+
+class CProfileResult(object):
+    """Top functions of a cProfile run
+
+    Parameters
+    ----------
+    profiler : cProfile.Profile or pstats.Stats
+        finished profiler
+    sort : str
+        'cumulative', 'tottime' or 'ncalls'
+    limit : int
+        number of functions to keep
+    path : str, optional
+        where the .prof file was saved
+
+    Example
+    -------
+    >>> profiler = cProfile.Profile()
+    >>> profiler.runcall(train, data)
+    >>> hdisplay(CProfileResult(profiler, sort='tottime'))
+    """
+    def __init__(self, profiler, sort='cumulative', limit=30, path=None):
+        if sort not in _SORT_KEYS:
+            raise ValueError('sort must be one of {}'.format(', '.join(sorted(_SORT_KEYS))))
+        stats = profiler if isinstance(profiler, pstats.Stats) else pstats.Stats(profiler)
+        self.path = path
+        self.sort = sort
+        self.total_calls = stats.total_calls
+        self.total_tt = stats.total_tt
+
+        callees = {}
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            for caller in callers:
+                callees.setdefault(caller, []).append(func)
+
+        rows = []
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            rows.append({
+                'function': func_label(func),
+                'ncalls': nc,
+                'primitive': cc,
+                'tottime': tt,
+                'cumtime': ct,
+                'callers': sorted(func_label(caller) for caller in callers),
+                'callees': sorted(func_label(callee) for callee in callees.get(func, [])),
+            })
+        key = _SORT_KEYS[sort]
+        rows.sort(key=lambda row: row[key], reverse=True)
+        self.rows = rows[:limit]
+
+    def __repr__(self):
+        lines = ['{} function calls in {:.3f} seconds'.format(self.total_calls, self.total_tt)]
+        lines.append('{:>10} {:>10} {:>10}  {}'.format('ncalls', 'tottime', 'cumtime', 'function'))
+        for row in self.rows:
+            lines.append('{:>10} {:>10.4f} {:>10.4f}  {}'.format(
+                row['ncalls'], row['tottime'], row['cumtime'], row['function']))
+        if self.path:
+            lines.append('saved to {}'.format(self.path))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _related(labels, limit=3):
+        if not labels:
+            return '', ''
+        shown = ', '.join(escape(label) for label in labels[:limit])
+        if len(labels) > limit:
+            shown += ', +{} more'.format(len(labels) - limit)
+        return shown, escape('\n'.join(labels))
+
+    def _repr_html_(self):
+        uid = 'ipytools-cprofile-{}'.format(random.randint(0, 10 ** 9))
+        headers = ['function', 'ncalls', 'tottime', 'percall', 'cumtime', 'percall', 'callers', 'callees']
+        head = ''.join('<th title="click to sort">{}</th>'.format(h) for h in headers)
+        body = []
+        for row in self.rows:
+            ncalls = row['ncalls']
+            calls = str(ncalls) if ncalls == row['primitive'] else '{}/{}'.format(ncalls, row['primitive'])
+            callers, callers_title = self._related(row['callers'])
+            callees, callees_title = self._related(row['callees'])
+            cells = [
+                (escape(row['function']), escape(row['function'])),
+                (ncalls, calls),
+                (row['tottime'], '{:.4f}'.format(row['tottime'])),
+                (row['tottime'] / ncalls if ncalls else 0, '{:.6f}'.format(row['tottime'] / ncalls if ncalls else 0)),
+                (row['cumtime'], '{:.4f}'.format(row['cumtime'])),
+                (row['cumtime'] / ncalls if ncalls else 0, '{:.6f}'.format(row['cumtime'] / ncalls if ncalls else 0)),
+                (len(row['callers']), '<span title="{}">{}</span>'.format(callers_title, callers)),
+                (len(row['callees']), '<span title="{}">{}</span>'.format(callees_title, callees)),
+            ]
+            body.append('<tr>{}</tr>'.format(''.join(
+                '<td data-value="{}" style="text-align:left;">{}</td>'.format(value, text)
+                for value, text in cells)))
+        caption = '{} function calls in {:.3f} seconds, top {} by {}'.format(
+            self.total_calls, self.total_tt, len(self.rows), self.sort)
+        if self.path:
+            caption += '; saved to {}'.format(escape(self.path))
+        table = '<table id="{}" class="ipytools-cprofile"><caption>{}</caption><thead><tr>{}</tr></thead><tbody>{}</tbody></table>'.format(
+            uid, caption, head, ''.join(body))
+        return table + _script % {'uid': uid}
+
+
+def run(code, namespace, path=None, sort='cumulative', limit=30):
+    """profile `code` in `namespace`, save the stats and summarize them
+
+    Parameters
+    ----------
+    code : code object
+        compiled cell
+    namespace : dict
+        globals for execution
+    path : str, optional
+        .prof file to write; skipped when None
+
+    Returns
+    -------
+    result : CProfileResult
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.runctx(code, namespace, namespace)
+    finally:
+        if path:
+            profiler.dump_stats(path)
+    return CProfileResult(profiler, sort=sort, limit=limit, path=path)
@@ -0,0 +1,224 @@
+"""In-process notebook conversion for `%export` and `ipytools-export`
+
+Drives nbconvert's exporters directly instead of starting `ipython
+nbconvert` in a subprocess.  Exporters are cached per (format, template),
+so the Jinja environment and the compiled template are built once per
+kernel and reused by every later export.  Works with the standalone
+`nbconvert` package before 6.0 and with IPython 3's bundled
+`IPython.nbconvert`.  nbconvert 6 removed `template_file`/`template_path`
+and the `full.tpl`/`basic.tpl` bases the ipytools templates extend, so
+with it `export_notebook` runs `python -m nbconvert` in a subprocess
+instead.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+TEMPLATE_DIR = '~/.ipython/extensions/templates'
+REVEAL_PREFIX = 'https://cdn.jsdelivr.net/reveal.js/2.6.2'
+# what nbconvert appends to the notebook name; 'script' and 'notebook'
+# are resolved in `output_path`
+EXTENSIONS = {'custom': '.txt', 'html': '.html', 'latex': '.tex', 'markdown': '.md', 'notebook': '.ipynb',
+              'pdf': '.pdf', 'python': '.py', 'rst': '.rst', 'script': '.py', 'slides': '.slides.html'}
+
+_exporters = {}
+_lock = threading.Lock()
+
+
+def _modules():
+    """(nbconvert, nbformat, Config) from whichever installation is present"""
+    try:
+        import nbconvert
+        import nbformat
+        from traitlets.config import Config
+    except ImportError:
+        from IPython import nbconvert, nbformat
+        from IPython.config import Config
+    return nbconvert, nbformat, Config
+
+
+def available():
+    """True when an nbconvert installation can be imported"""
+    try:
+        _modules()
+    except ImportError:
+        return False
+    return True
+
+
+def in_process():
+    """True when the importable nbconvert can render the .tpl templates here"""
+    try:
+        nbconvert, _, _ = _modules()
+    except ImportError:
+        return False
+    version = getattr(nbconvert, '__version__', None)
+    # IPython.nbconvert has no version of its own and predates nbconvert 6
+    return version is None or int(version.split('.')[0]) < 6
+
+
+def command(path, to='html', template=None, build_directory=''):
+    """argv of the `nbconvert` run used when conversion is not in-process
+
+    No shell is involved, so any notebook file name is passed through as is.
+    """
+    argv = [sys.executable, '-m', 'nbconvert', '--to', to]
+    if template:
+        argv += ['--template', template]
+    if to == 'slides':
+        argv += ['--reveal-prefix', REVEAL_PREFIX]
+    if build_directory:
+        argv += ['--output-dir', build_directory]
+    if path.startswith('-'):
+        # not an option
+        path = os.path.join(os.curdir, path)
+    return argv + [path]
+
+
+def output_path(path, to='html', build_directory=''):
+    """file nbconvert writes for the notebook at `path`
+
+    Without `build_directory` nbconvert writes next to the notebook.
+    """
+    directory = build_directory or os.path.dirname(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    extension = EXTENSIONS.get(to, '')
+    if to == 'script':
+        # the kernel language decides, as in ScriptExporter
+        try:
+            with open(path) as f:
+                language = json.load(f).get('metadata', {}).get('language_info', {})
+            extension = language.get('file_extension') or extension
+        except (IOError, ValueError):
+            pass
+    elif to == 'notebook' and os.path.abspath(directory) == os.path.abspath(os.path.dirname(path)):
+        # nbconvert does not overwrite the input notebook
+        name += '.nbconvert'
+    return os.path.join(directory, name + extension)
+
+
+def _export_subprocess(path, to, template, build_directory, progress):
+    progress('convert')
+    argv = command(path, to, template, build_directory)
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log = process.communicate()[0].decode('utf-8', 'replace').strip()
+    if process.returncode:
+        raise RuntimeError(log.splitlines()[-1] if log else ' '.join(argv))
+    progress('write')
+    # nbconvert logs the file it wrote; fall back to predicting it
+    written = re.findall(r'Writing \d+ bytes to (.+)$', log, re.M)
+    return written[-1].strip() if written else output_path(path, to, build_directory)
+
+
+def _config(to, template, template_dir):
+    _, _, Config = _modules()
+    config = Config()
+    directory = os.path.expanduser(template_dir)
+    if template:
+        config.TemplateExporter.template_file = template
+        config.TemplateExporter.template_path = ['.', directory]
+    if to == 'slides':
+        # IPython 3 / nbconvert < 5 and nbconvert >= 5 spell the option differently
+        config.RevealHelpPreprocessor.url_prefix = REVEAL_PREFIX
+        config.SlidesExporter.reveal_url_prefix = REVEAL_PREFIX
+    return config
+
+
+def get_exporter(to='html', template=None, template_dir=TEMPLATE_DIR):
+    """cached exporter instance for a format and template
+
+    Parameters
+    ----------
+    to : str
+        nbconvert format, e.g. 'html', 'slides', 'latex', 'markdown';
+        'custom' uses the bare TemplateExporter
+    template : str, optional
+        .tpl file looked up in the working directory, then `template_dir`
+    template_dir : str
+        directory with the ipytools templates
+
+    Returns
+    -------
+    exporter : nbconvert Exporter
+    """
+    key = (to, template, template_dir)
+    exporter = _exporters.get(key)
+    if exporter is None:
+        with _lock:
+            exporter = _exporters.get(key)
+            if exporter is None:
+                nbconvert, _, _ = _modules()
+                if to == 'custom':
+                    exporter_class = nbconvert.TemplateExporter
+                else:
+                    exporter_class = nbconvert.get_exporter(to)
+                exporter = _exporters[key] = exporter_class(config=_config(to, template, template_dir))
+    return exporter
+
+
+def _writer():
+    try:
+        from nbconvert.writers import FilesWriter
+    except ImportError:
+        from IPython.nbconvert.writers import FilesWriter
+    return FilesWriter()
+
+
+def export_notebook(path, to='html', template=None, template_dir=TEMPLATE_DIR, build_directory='',
+                    progress=None):
+    """convert the notebook at `path` and write the result like `ipython nbconvert`
+
+    Runs in-process when `in_process()`, otherwise through `command()`.
+
+    Parameters
+    ----------
+    path : str
+        .ipynb file
+    to : str
+        nbconvert format
+    template : str, optional
+        .tpl file, see `get_exporter`
+    template_dir : str
+        directory with the ipytools templates
+    build_directory : str
+        output directory; '' writes to the working directory
+    progress : callable, optional
+        called with 'convert' and then 'write' as each stage starts
+
+    Returns
+    -------
+    output : str
+        path of the written file
+    """
+    progress = progress or (lambda stage: None)
+    if not in_process():
+        return _export_subprocess(path, to, template, build_directory, progress)
+    _, nbformat, _ = _modules()
+    progress('convert')
+    exporter = get_exporter(to, template, template_dir)
+    with open(path) as f:
+        notebook = nbformat.read(f, as_version=4)
+
+    directory, filename = os.path.split(path)
+    name = os.path.splitext(filename)[0]
+    resources = {
+        'metadata': {'name': name, 'path': directory},
+        'unique_key': name,
+        'output_files_dir': '{}_files'.format(name),
+    }
+    with _lock:
+        # exporters keep per-call state on the instance; serialize their use
+        body, resources = exporter.from_notebook_node(notebook, resources=resources)
+    progress('write')
+    writer = _writer()
+    writer.build_directory = build_directory
+    return writer.write(body, resources, notebook_name=name)
+
+
+def clear_cache():
+    """drop cached exporters, e.g. after editing a template"""
+    with _lock:
+        _exporters.clear()
@@ -0,0 +1,73 @@
+_template = """
+{% if not total %}
+<div class="ipytools-flame" style="font:11px monospace;">
+  <b>{{ title }}</b> &mdash; no samples over {{ elapsed }}.
+  The block finished before the first sample; lower `interval` or profile a longer run.
+</div>
+{% else %}
+<div class="ipytools-flame" style="font:11px monospace;">
+  <div style="padding-bottom:4px;">
+    <b>{{ title }}</b> &mdash; {{ samples }} samples over {{ elapsed }}.
+    Click a frame to zoom, click the top row to reset.
+  </div>
+  <div id="{{ uid }}" style="position:relative;width:100%;"></div>
+</div>
+<script>
+(function() {
+  var data = {{ data }};
+  var container = document.getElementById('{{ uid }}');
+  var rowHeight = 18;
+
+  function hue(name) {
+    var hash = 0;
+    for (var i = 0; i < name.length; i++) {
+      hash = (hash * 31 + name.charCodeAt(i)) % 360;
+    }
+    return 10 + hash % 50;
+  }
+
+  function depth(node) {
+    var deepest = 0;
+    for (var i = 0; i < node.children.length; i++) {
+      deepest = Math.max(deepest, depth(node.children[i]));
+    }
+    return deepest + 1;
+  }
+
+  function box(node, left, width, level, focus) {
+    var div = document.createElement('div');
+    var share = (100 * node.value / data.value).toFixed(1);
+    div.title = node.name + ' (' + node.value + ' samples, ' + share + '%)';
+    div.textContent = node.name;
+    div.style.cssText = 'position:absolute;overflow:hidden;white-space:nowrap;' +
+      'box-sizing:border-box;border:1px solid #fff;cursor:pointer;padding-left:2px;' +
+      'height:' + rowHeight + 'px;top:' + (level * rowHeight) + 'px;' +
+      'left:' + (left * 100) + '%;width:' + (width * 100) + '%;' +
+      'background:hsl(' + hue(node.name) + ',80%,' + (node === focus ? 50 : 65) + '%);';
+    div.onclick = function() { render(node === focus ? data : node); };
+    container.appendChild(div);
+  }
+
+  function layout(node, left, width, level, focus) {
+    if (width < 0.002) { return; }
+    box(node, left, width, level, focus);
+    var offset = left;
+    for (var i = 0; i < node.children.length; i++) {
+      var child = node.children[i];
+      var childWidth = width * child.value / node.value;
+      layout(child, offset, childWidth, level + 1, focus);
+      offset += childWidth;
+    }
+  }
+
+  function render(focus) {
+    container.innerHTML = '';
+    container.style.height = (depth(data) * rowHeight) + 'px';
+    layout(focus, 0, 1, 0, focus);
+  }
+
+  render(data);
+})();
+</script>
+{% endif %}
+"""
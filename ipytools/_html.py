@@ -0,0 +1,21 @@
+"""HTML escaping shared by the `_repr_html_` renderers"""
+try:
+    from html import escape as _escape
+except ImportError:
+    from cgi import escape as _escape
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+def escape(text):
+    """escape `text` for use in HTML content and quoted attributes
+
+    Non-string values are converted with `str` first, so numbers and None
+    can be passed straight through.
+    """
+    if not isinstance(text, _string_types):
+        text = str(text)
+    return _escape(text, quote=True)
@@ -0,0 +1,192 @@
+"""Per-module import timing behind the `%importtime` magic
+
+Like `python -X importtime`, but inside a running kernel.  On Python 3 the
+hook wraps `importlib._bootstrap._find_and_load`, which the interpreter
+calls once for every module that is not in `sys.modules` yet, parents of
+dotted names included.  Python 2 has no such hook, so `__builtin__.__import__`
+is wrapped instead and calls that load no new module are dropped; the
+None entries implicit relative imports leave in `sys.modules` do not count.
+"""
+import sys
+
+from . import _clocks
+from ._spans import tree_html
+from ._stats import format_duration
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+try:
+    from importlib import _bootstrap
+except ImportError:
+    _bootstrap = None
+
+_find_and_load = getattr(_bootstrap, '_find_and_load', None)
+
+
+def _relative_miss(name, globals=None, locals=None, fromlist=None, level=-1):
+    """sys.modules key a Python 2 implicit relative import of `name` may
+    set to None when the package has no such submodule, or None"""
+    if level != -1 or not globals or not globals.get('__name__'):
+        return None
+    package = globals.get('__package__')
+    if package is None:
+        package = globals['__name__']
+        if '__path__' not in globals:
+            package = package.rpartition('.')[0]
+    if not package:
+        return None
+    return '{}.{}'.format(package, name.partition('.')[0])
+
+
+class ImportNode(object):
+    """One imported module with the modules its import pulled in"""
+    __slots__ = ('name', 'parent', 'children', 'cumulative_ns', 'order')
+
+    def __init__(self, name, parent=None, order=0):
+        self.name = name
+        self.parent = parent
+        self.children = []
+        self.cumulative_ns = 0
+        self.order = order
+
+    @property
+    def self_ns(self):
+        return self.cumulative_ns - sum(child.cumulative_ns for child in self.children)
+
+    def sorted_children(self, sort='cumulative', min_ns=0):
+        """children at or above `min_ns`, ordered by `sort`"""
+        children = [child for child in self.children if child.cumulative_ns >= min_ns]
+        if sort == 'order':
+            return sorted(children, key=lambda node: node.order)
+        key = (lambda node: node.self_ns) if sort == 'self' else (lambda node: node.cumulative_ns)
+        return sorted(children, key=key, reverse=True)
+
+
+class ImportTimer(object):
+    """Context manager timing every module imported inside the block
+
+    Example
+    -------
+    >>> with ImportTimer() as timer:
+    ...     import pandas
+    ...
+    >>> hdisplay(timer.report())
+    """
+    def __init__(self):
+        self.root = ImportNode('<imports>')
+        self._stack = [self.root]
+        self._count = 0
+        self._original = None
+
+    def _timed(self, name, load, miss, *args, **kwargs):
+        parent = self._stack[-1]
+        self._count += 1
+        node = ImportNode(name, parent, self._count)
+        parent.children.append(node)
+        self._stack.append(node)
+        loaded = len(sys.modules)
+        if miss in sys.modules:
+            miss = None
+        start = _clocks.wall_ns()
+        try:
+            return load(*args, **kwargs)
+        finally:
+            node.cumulative_ns = _clocks.wall_ns() - start
+            self._stack.pop()
+            added = len(sys.modules) - loaded
+            if miss is not None and sys.modules.get(miss, False) is None:
+                # an implicit relative lookup that failed, not a module
+                added -= 1
+            if _find_and_load is None and not added:
+                # nothing new was loaded: hoist any children and drop the node
+                parent.children.remove(node)
+                parent.children.extend(node.children)
+                for child in node.children:
+                    child.parent = parent
+
+    def _hook(self, name, *args, **kwargs):
+        miss = _relative_miss(name, *args, **kwargs) if _find_and_load is None else None
+        return self._timed(name, self._original, miss, name, *args, **kwargs)
+
+    def __enter__(self):
+        if _find_and_load is not None:
+            self._original = _bootstrap._find_and_load
+            _bootstrap._find_and_load = self._hook
+        else:
+            self._original = builtins.__import__
+            builtins.__import__ = self._hook
+        self._start = _clocks.wall_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.root.cumulative_ns = _clocks.wall_ns() - self._start
+        if _find_and_load is not None:
+            _bootstrap._find_and_load = self._original
+        else:
+            builtins.__import__ = self._original
+
+    def report(self, sort='cumulative', min_ns=0):
+        """ImportReport of the modules imported in the block
+
+        Parameters
+        ----------
+        sort : str
+            'cumulative', 'self' or 'order' (import order)
+        min_ns : int
+            hide modules whose cumulative time is below this
+        """
+        return ImportReport(self.root, sort=sort, min_ns=min_ns)
+
+
+class ImportReport(object):
+    """Tree of imported modules with self and cumulative import time
+
+    Modules below `min_ns` are hidden but still counted in their parent's
+    cumulative time and in `modules`.
+    """
+    headers = ['self', 'cumulative', '% total']
+
+    def __init__(self, root, sort='cumulative', min_ns=0):
+        if sort not in ('cumulative', 'self', 'order'):
+            raise ValueError("sort must be 'cumulative', 'self' or 'order'")
+        self.root = root
+        self.sort = sort
+        self.min_ns = min_ns
+        self.total_ns = root.cumulative_ns
+        self.modules = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            self.modules += len(node.children)
+            stack.extend(node.children)
+
+    def _children(self, node):
+        return node.sorted_children(self.sort, self.min_ns)
+
+    def _row(self, node):
+        share = 100.0 * node.cumulative_ns / self.total_ns if self.total_ns else 0.0
+        return [format_duration(node.self_ns), format_duration(node.cumulative_ns), '{:.1f}%'.format(share)]
+
+    def _title(self):
+        if not self.modules:
+            return 'no new modules imported (already in sys.modules?) in {}'.format(format_duration(self.total_ns))
+        return '{} modules imported in {}'.format(self.modules, format_duration(self.total_ns))
+
+    def __repr__(self):
+        lines = [self._title(), '{:>12} | {:>12} | {}'.format('self', 'cumulative', 'module')]
+
+        def walk(node, depth):
+            for child in self._children(node):
+                lines.append('{:>12} | {:>12} | {}{}'.format(
+                    format_duration(child.self_ns), format_duration(child.cumulative_ns),
+                    '  ' * depth, child.name))
+                walk(child, depth + 1)
+        walk(self.root, 0)
+        return '\n'.join(lines)
+
+    def _repr_html_(self):
+        return tree_html(self._children(self.root), self.headers, self._row,
+                         title=self._title(), children=self._children)
@@ -0,0 +1,266 @@
+"""Pure-Python line profiler behind the `%%lprofile` magic
+
+Only the code objects of the requested functions are instrumented.  On
+Python 3.12+ line events come from `sys.monitoring`, enabled locally on
+those code objects, so the rest of the program runs at full speed; older
+interpreters fall back to `sys.settrace`, which installs a cheap global
+tracer that only returns a line tracer for the requested functions.
+
+Time is charged to a line from its line event until the next line or
+return event of the same frame, so a line's time includes the calls it
+makes.  Generator frames are charged only while they run, and a frame
+left by an exception closes out its last line like a return.
+"""
+import inspect
+import linecache
+import os
+import sys
+
+from . import _clocks
+from ._html import escape
+from ._stats import format_duration
+
+_TOOL_IDS = (2, 3, 4, 5)  # sys.monitoring.PROFILER_ID first, then free ids
+
+
+def code_of(func):
+    """code object of a function, method, staticmethod or decorated function"""
+    while True:
+        func = getattr(func, '__func__', func)
+        wrapped = getattr(func, '__wrapped__', None)
+        if wrapped is None:
+            break
+        func = wrapped
+    code = getattr(func, '__code__', None) or getattr(func, 'func_code', None)
+    if code is None:
+        raise TypeError('cannot line-profile {!r}: no Python code object'.format(func))
+    return code
+
+
+class LineProfiler(object):
+    """Collect per-line hits and time of selected functions
+
+    Parameters
+    ----------
+    functions : list
+        functions (or methods) to instrument
+
+    Example
+    -------
+    >>> profiler = LineProfiler([parse, tokenize])
+    >>> with profiler:
+    ...     parse(text)
+    ...
+    >>> hdisplay(profiler.result())
+    """
+    def __init__(self, functions):
+        self.codes = [code_of(func) for func in functions]
+        self.lines = dict((code, {}) for code in self.codes)
+        self._frames = {}
+        self._tool = None
+        self._previous_trace = None
+        self.backend = 'sys.monitoring' if hasattr(sys, 'monitoring') else 'sys.settrace'
+
+    # -- shared accounting -------------------------------------------------
+
+    def _enter(self, frame_id, now):
+        self._frames[frame_id] = (None, now)
+
+    def _line(self, code, frame_id, lineno, now):
+        last, since = self._frames.get(frame_id, (None, now))
+        lines = self.lines[code]
+        if last is not None:
+            lines[last][1] += now - since
+        entry = lines.get(lineno)
+        if entry is None:
+            entry = lines[lineno] = [0, 0]
+        entry[0] += 1
+        self._frames[frame_id] = (lineno, _clocks.wall_ns())
+
+    def _leave(self, code, frame_id, now):
+        last, since = self._frames.pop(frame_id, (None, now))
+        if last is not None:
+            self.lines[code][last][1] += now - since
+
+    # -- sys.settrace backend ----------------------------------------------
+
+    def _global_trace(self, frame, event, arg):
+        code = frame.f_code
+        if code not in self.lines:
+            return None
+        self._enter(id(frame), _clocks.wall_ns())
+        return self._local_trace
+
+    def _local_trace(self, frame, event, arg):
+        now = _clocks.wall_ns()
+        if event == 'line':
+            self._line(frame.f_code, id(frame), frame.f_lineno, now)
+        elif event == 'return':
+            self._leave(frame.f_code, id(frame), now)
+        return self._local_trace
+
+    # -- sys.monitoring backend --------------------------------------------
+
+    def _on_start(self, code, offset):
+        self._enter(id(sys._getframe(1)), _clocks.wall_ns())
+
+    def _on_line(self, code, lineno):
+        self._line(code, id(sys._getframe(1)), lineno, _clocks.wall_ns())
+
+    def _on_leave(self, code, offset, value):
+        self._leave(code, id(sys._getframe(1)), _clocks.wall_ns())
+
+    def _on_unwind(self, code, offset, exception):
+        # PY_UNWIND cannot be enabled per code object, so it fires for every frame
+        if code in self.lines:
+            self._leave(code, id(sys._getframe(1)), _clocks.wall_ns())
+
+    def _start_monitoring(self):
+        monitoring = sys.monitoring
+        for tool in _TOOL_IDS:
+            if monitoring.get_tool(tool) is None:
+                break
+        else:
+            return False
+        monitoring.use_tool_id(tool, 'ipytools-lprofile')
+        events = monitoring.events
+        monitoring.register_callback(tool, events.PY_START, self._on_start)
+        monitoring.register_callback(tool, events.PY_RESUME, self._on_start)
+        monitoring.register_callback(tool, events.LINE, self._on_line)
+        monitoring.register_callback(tool, events.PY_RETURN, self._on_leave)
+        monitoring.register_callback(tool, events.PY_YIELD, self._on_leave)
+        monitoring.register_callback(tool, events.PY_UNWIND, self._on_unwind)
+        monitoring.set_events(tool, events.PY_UNWIND)
+        wanted = events.PY_START | events.PY_RESUME | events.LINE | events.PY_RETURN | events.PY_YIELD
+        for code in self.codes:
+            monitoring.set_local_events(tool, code, wanted)
+        self._tool = tool
+        return True
+
+    def _stop_monitoring(self):
+        monitoring = sys.monitoring
+        for code in self.codes:
+            monitoring.set_local_events(self._tool, code, 0)
+        monitoring.set_events(self._tool, 0)
+        for event in ('PY_START', 'PY_RESUME', 'LINE', 'PY_RETURN', 'PY_YIELD', 'PY_UNWIND'):
+            monitoring.register_callback(self._tool, getattr(monitoring.events, event), None)
+        monitoring.free_tool_id(self._tool)
+        self._tool = None
+
+    # -- control -----------------------------------------------------------
+
+    def start(self):
+        if self.backend == 'sys.monitoring' and self._start_monitoring():
+            return
+        self.backend = 'sys.settrace'
+        self._previous_trace = sys.gettrace()
+        sys.settrace(self._global_trace)
+
+    def stop(self):
+        if self._tool is not None:
+            self._stop_monitoring()
+        else:
+            sys.settrace(self._previous_trace)
+        self._frames.clear()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def result(self):
+        """LProfileResult with annotated source of every instrumented function"""
+        return LProfileResult([FunctionLines(code, self.lines[code]) for code in self.codes],
+                              self.backend)
+
+
+class FunctionLines(object):
+    """Per-line hits and time of one function, joined with its source"""
+    def __init__(self, code, lines):
+        self.name = code.co_name
+        self.filename = code.co_filename
+        self.firstlineno = code.co_firstlineno
+        self.lines = lines
+        self.total_ns = sum(time_ns for hits, time_ns in lines.values())
+        self.source = self._source(code, lines)
+
+    @staticmethod
+    def _source(code, lines):
+        try:
+            source, start = inspect.getsourcelines(code)
+        except (IOError, OSError, TypeError):
+            start = code.co_firstlineno
+            last = max([start] + list(lines))
+            source = [linecache.getline(code.co_filename, lineno) for lineno in range(start, last + 1)]
+        return [(start + offset, line.rstrip('\n')) for offset, line in enumerate(source)]
+
+    def rows(self):
+        """(lineno, hits, time_ns, per_hit_ns, fraction, source) for each source line"""
+        rows = []
+        for lineno, text in self.source:
+            hits, time_ns = self.lines.get(lineno, (0, 0))
+            rows.append((lineno, hits, time_ns, float(time_ns) / hits if hits else 0,
+                         float(time_ns) / self.total_ns if self.total_ns else 0, text))
+        return rows
+
+    @property
+    def location(self):
+        return '{} ({}:{})'.format(self.name, os.path.basename(self.filename), self.firstlineno)
+
+
+class LProfileResult(object):
+    """Annotated source of line-profiled functions
+
+    Attributes
+    ----------
+    functions : list
+        one FunctionLines per profiled function
+    backend : str
+        'sys.monitoring' or 'sys.settrace'
+    """
+    def __init__(self, functions, backend):
+        self.functions = functions
+        self.backend = backend
+
+    def __repr__(self):
+        blocks = []
+        for function in self.functions:
+            lines = ['{}: total {}'.format(function.location, format_duration(function.total_ns)),
+                     '{:>6} {:>8} {:>10} {:>10} {:>6}  {}'.format('line', 'hits', 'time', 'per hit', '%', 'source')]
+            for lineno, hits, time_ns, per_hit, fraction, text in function.rows():
+                if hits:
+                    lines.append('{:>6} {:>8} {:>10} {:>10} {:>6.1f}  {}'.format(
+                        lineno, hits, format_duration(time_ns), format_duration(per_hit),
+                        100 * fraction, text))
+                else:
+                    lines.append('{:>6} {:>8} {:>10} {:>10} {:>6}  {}'.format(lineno, '', '', '', '', text))
+            blocks.append('\n'.join(lines))
+        return '\n\n'.join(blocks)
+
+    @staticmethod
+    def _heat(fraction):
+        """background color for a line's share of the function's time"""
+        return 'rgba(220, 50, 32, {:.2f})'.format(min(1.0, 0.08 + 0.9 * fraction)) if fraction else 'transparent'
+
+    def _repr_html_(self):
+        tables = []
+        cell = '<td style="text-align:right;">{}</td>'
+        for function in self.functions:
+            body = []
+            for lineno, hits, time_ns, per_hit, fraction, text in function.rows():
+                body.append(
+                    '<tr>{}{}<td style="text-align:right;background:{};">{}</td>{}{}'
+                    '<td style="text-align:left;"><pre style="margin:0;">{}</pre></td></tr>'.format(
+                        cell.format(lineno), cell.format(hits or ''), self._heat(fraction),
+                        format_duration(time_ns) if hits else '',
+                        cell.format(format_duration(per_hit) if hits else ''),
+                        cell.format('{:.1f}'.format(100 * fraction) if hits else ''),
+                        escape(text) or '&nbsp;'))
+            tables.append(
+                '<table class="ipytools-lprofile"><caption>{} &mdash; total {}</caption>'
+                '<thead><tr><th>line</th><th>hits</th><th>time</th><th>per hit</th><th>%</th>'
+                '<th style="text-align:left;">source</th></tr></thead><tbody>{}</tbody></table>'.format(
+                    escape(function.location), format_duration(function.total_ns), ''.join(body)))
+        return '<div class="ipytools-lprofile">{}<p>timed with {}</p></div>'.format(''.join(tables), self.backend)
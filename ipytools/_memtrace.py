@@ -0,0 +1,246 @@
+"""tracemalloc snapshot diffs behind the `%%memtrace` magic
+
+A single run compares snapshots taken before and after the code and ranks
+allocation sites by net growth.  Leak mode runs the code several times and
+snapshots after every run: a site whose memory grows on (nearly) every
+repetition is reported with its growth per run, which separates real leaks
+from caches that fill once.
+"""
+import fnmatch
+import gc
+import os
+import sys
+
+from ._html import escape
+from ._stats import format_bytes, median
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+GROUPINGS = ('lineno', 'traceback', 'filename')
+
+# tracebacks list the oldest frame first since Python 3.7
+_OLDEST_FIRST = sys.version_info >= (3, 7)
+
+
+def _filters():
+    return [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__.replace('.pyc', '.py')),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ]
+
+
+def _snapshot(filters):
+    gc.collect()
+    return tracemalloc.take_snapshot().filter_traces(filters)
+
+
+def _frames(traceback):
+    """'file:line' of each frame, most recent first"""
+    frames = list(traceback)
+    if _OLDEST_FIRST:
+        frames.reverse()
+    return ['{}:{}'.format(frame.filename, frame.lineno) if frame.lineno else frame.filename
+            for frame in frames]
+
+
+def _label(traceback):
+    frames = _frames(traceback)
+    return frames[0] if frames else '?'
+
+
+def run(code, namespace, group='lineno', limit=10, frames=10, repeat=1):
+    """execute `code` under tracemalloc and diff the snapshots
+
+    Parameters
+    ----------
+    code : code object
+        compiled cell
+    namespace : dict
+        globals for execution
+    group : str
+        'lineno', 'traceback' or 'filename'
+    limit : int
+        number of allocation sites to keep
+    frames : int
+        frames stored per allocation when tracemalloc is started here
+    repeat : int
+        executions; above 1 turns on leak mode
+
+    Returns
+    -------
+    result : MemTraceResult or LeakResult
+    """
+    if tracemalloc is None:
+        raise RuntimeError('tracemalloc needs Python 3.4 or newer')
+    if group not in GROUPINGS:
+        raise ValueError('group must be one of {}'.format(', '.join(GROUPINGS)))
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    filters = _filters()
+    for pattern in filters:
+        # compile the patterns now so fnmatch's cache does not show up as growth
+        fnmatch.fnmatch('', pattern.filename_pattern)
+    try:
+        snapshots = [_snapshot(filters)]
+        for _ in range(max(1, repeat)):
+            exec(code, namespace)
+            snapshots.append(_snapshot(filters))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if started:
+            tracemalloc.stop()
+    if repeat > 1:
+        return LeakResult(snapshots, group, limit)
+    return MemTraceResult(snapshots[0], snapshots[1], group, limit, peak)
+
+
+class MemTraceResult(object):
+    """Top allocation sites by net growth between two snapshots
+
+    Attributes
+    ----------
+    rows : list
+        dicts with site, size_diff, size, count_diff, count and traceback
+    net : int
+        net traced bytes over all sites
+    """
+    def __init__(self, before, after, group='lineno', limit=10, peak=None):
+        stats = after.compare_to(before, group)
+        self.group = group
+        self.peak = peak
+        self.net = sum(stat.size_diff for stat in stats)
+        stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+        self.rows = [{
+            'site': _label(stat.traceback),
+            'size_diff': stat.size_diff,
+            'size': stat.size,
+            'count_diff': stat.count_diff,
+            'count': stat.count,
+            'traceback': _frames(stat.traceback),
+        } for stat in stats[:limit] if stat.size_diff > 0]
+
+    def _title(self):
+        text = 'net {} traced, top {} sites by growth ({})'.format(
+            format_bytes(self.net, signed=True), len(self.rows), self.group)
+        if self.peak is not None:
+            text += ', tracemalloc peak {}'.format(format_bytes(self.peak))
+        return text
+
+    def __repr__(self):
+        lines = [self._title()]
+        for row in self.rows:
+            lines.append('{:>12} {:>8}  {}'.format(
+                format_bytes(row['size_diff'], signed=True), '{:+d}'.format(row['count_diff']), row['site']))
+            if self.group == 'traceback':
+                lines.extend('{:>24}{}'.format('', frame) for frame in row['traceback'][1:])
+        return '\n'.join(lines)
+
+    def _repr_html_(self):
+        largest = max([row['size_diff'] for row in self.rows] or [0])
+        body = []
+        for row in self.rows:
+            site = escape(_short(row['site']))
+            if self.group == 'traceback' and len(row['traceback']) > 1:
+                site = '<details><summary>{}</summary><pre style="margin:0;">{}</pre></details>'.format(
+                    site, escape('\n'.join(row['traceback'][1:])))
+            body.append('<tr><td style="text-align:left;" title="{}">{}</td><td>{}</td><td>{}</td>'
+                        '<td>{}</td><td>{}</td><td style="text-align:left;">{}</td></tr>'.format(
+                            escape(row['site']), site, format_bytes(row['size_diff'], signed=True),
+                            format_bytes(row['size']), '{:+d}'.format(row['count_diff']), row['count'],
+                            _bar(row['size_diff'], largest)))
+        return ('<table class="ipytools-memtrace"><caption>{}</caption><thead><tr>'
+                '<th>site</th><th>growth</th><th>size</th><th>blocks +</th><th>blocks</th><th></th>'
+                '</tr></thead><tbody>{}</tbody></table>').format(escape(self._title()), ''.join(body))
+
+
+class LeakResult(object):
+    """Allocation sites growing across repeated executions
+
+    Attributes
+    ----------
+    runs : int
+        executions compared
+    rows : list
+        dicts with site, per_run (median growth per execution), growing
+        (executions with growth), total growth and traceback; sites growing
+        in all but at most one execution come first
+    """
+    def __init__(self, snapshots, group='lineno', limit=10):
+        self.group = group
+        self.runs = len(snapshots) - 1
+        growth = {}
+        tracebacks = {}
+        for index in range(1, len(snapshots)):
+            for stat in snapshots[index].compare_to(snapshots[index - 1], group):
+                key = _label(stat.traceback) if group != 'traceback' else tuple(_frames(stat.traceback))
+                growth.setdefault(key, [0] * self.runs)[index - 1] += stat.size_diff
+                tracebacks[key] = _frames(stat.traceback)
+
+        rows = []
+        for key, diffs in growth.items():
+            growing = sum(1 for diff in diffs if diff > 0)
+            total = sum(diffs)
+            if total <= 0:
+                continue
+            rows.append({
+                'site': _label_text(key),
+                'per_run': int(median(sorted(diffs[1:] or diffs))),
+                'growing': growing,
+                'total': total,
+                'traceback': tracebacks[key],
+                'leak': growing >= self.runs - 1 and self.runs > 1,
+            })
+        rows.sort(key=lambda row: (row['leak'], row['per_run'], row['total']), reverse=True)
+        self.rows = rows[:limit]
+        self.leaks = [row for row in self.rows if row['leak'] and row['per_run'] > 0]
+
+    def _title(self):
+        return '{} executions: {} allocation sites grow steadily'.format(self.runs, len(self.leaks))
+
+    def __repr__(self):
+        lines = [self._title()]
+        for row in self.rows:
+            lines.append('{:>12}/run {:>5} {:>12}  {}{}'.format(
+                format_bytes(row['per_run'], signed=True), '{}/{}'.format(row['growing'], self.runs),
+                format_bytes(row['total'], signed=True), row['site'], '  <- leak?' if row['leak'] else ''))
+        return '\n'.join(lines)
+
+    def _repr_html_(self):
+        largest = max([row['per_run'] for row in self.rows] or [0])
+        body = []
+        for row in self.rows:
+            site = escape(_short(row['site']))
+            if self.group == 'traceback' and len(row['traceback']) > 1:
+                site = '<details><summary>{}</summary><pre style="margin:0;">{}</pre></details>'.format(
+                    site, escape('\n'.join(row['traceback'][1:])))
+            style = ' style="color:#b00;"' if row['leak'] else ''
+            body.append('<tr{}><td style="text-align:left;" title="{}">{}</td><td>{}</td><td>{}/{}</td>'
+                        '<td>{}</td><td style="text-align:left;">{}</td></tr>'.format(
+                            style, escape(row['site']), site, format_bytes(row['per_run'], signed=True),
+                            row['growing'], self.runs, format_bytes(row['total'], signed=True),
+                            _bar(row['per_run'], largest)))
+        return ('<table class="ipytools-memtrace"><caption>{}</caption><thead><tr>'
+                '<th>site</th><th>growth per run</th><th>runs growing</th><th>total</th><th></th>'
+                '</tr></thead><tbody>{}</tbody></table>').format(escape(self._title()), ''.join(body))
+
+
+def _label_text(key):
+    return key[0] if isinstance(key, tuple) else key
+
+
+def _short(site):
+    path, _, lineno = site.rpartition(':')
+    return '{}:{}'.format(os.path.basename(path), lineno) if path else site
+
+
+def _bar(value, largest):
+    width = int(120.0 * value / largest) if largest and value > 0 else 0
+    return '<div style="background:#d9534f;height:10px;width:{}px;"></div>'.format(width)
+
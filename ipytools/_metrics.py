@@ -0,0 +1,312 @@
+"""In-process counters, gauges and timing histograms
+
+Metrics are plain Python objects updated without locks; under the GIL an
+update is a couple of bytecodes, cheap enough for hot paths, and at worst
+a concurrent increment is lost.  Timing histograms reuse the fixed-memory
+LatencyHistogram behind `Timer.track`.  A registry renders as an HTML
+snapshot through `hdisplay` and writes the Prometheus text exposition
+format, optionally on a background thread so scheduled notebooks leave a
+scrapeable file behind.
+"""
+import atexit
+import bisect
+import functools
+import os
+import re
+import tempfile
+import threading
+
+from . import _clocks
+from ._histogram import LatencyHistogram
+from ._html import escape
+from ._stats import format_duration
+
+_NAME = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+_LABEL = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+
+# registries with a running dump thread, stopped by one atexit hook
+_dumping = set()
+_atexit_registered = [False]
+
+# upper bounds (seconds) of the cumulative buckets exported for histograms
+BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+_BUCKET_NS = [int(upper * _clocks.NS_PER_SECOND) for upper in BUCKETS]
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _label_text(labels, extra=None):
+    pairs = sorted(labels.items()) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, _escape(value)) for key, value in pairs) + '}'
+
+
+class Counter(object):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def __init__(self, name, help='', labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        """add `amount` (must not be negative)"""
+        if amount < 0:
+            raise ValueError('counters can only increase')
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, _label_text(self.labels), self.value)]
+
+    def display_value(self):
+        return self.value
+
+
+class Gauge(object):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def __init__(self, name, help='', labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        return [(self.name, _label_text(self.labels), self.value)]
+
+    def display_value(self):
+        return self.value
+
+
+class Histogram(object):
+    """Timing histogram in seconds, backed by a LatencyHistogram
+
+    The LatencyHistogram gives the percentiles shown by `hdisplay`; the
+    exported `le` buckets are exact counters kept per bound, since its
+    internal buckets do not line up with `BUCKETS`.
+
+    Example
+    -------
+    >>> load_seconds = metrics.histogram('load_seconds', 'Time to load a batch')
+    >>> with load_seconds.time():
+    ...     batch = load()
+    ...
+    >>> @load_seconds.time()
+    ... def load():
+    ...     ...
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help='', labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.histogram = LatencyHistogram(name)
+        # observations per `le` bound, the last one for +Inf; not cumulative
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        """record one duration in seconds"""
+        self.observe_ns(int(seconds * _clocks.NS_PER_SECOND))
+
+    def observe_ns(self, ns):
+        """record one duration in nanoseconds"""
+        self.histogram.record(ns)
+        self.buckets[bisect.bisect_left(_BUCKET_NS, ns)] += 1
+
+    def time(self):
+        """context manager and decorator timing a block into this histogram"""
+        return _HistogramTimer(self)
+
+    def samples(self):
+        hist = self.histogram
+        cumulative = []
+        seen = 0
+        for count in self.buckets:
+            seen += count
+            cumulative.append(seen)
+        samples = [
+            (self.name + '_bucket', _label_text(self.labels, [('le', '{:g}'.format(upper))]), count)
+            for upper, count in zip(BUCKETS, cumulative)
+        ]
+        samples.append((self.name + '_bucket', _label_text(self.labels, [('le', '+Inf')]), seen))
+        samples.append((self.name + '_sum', _label_text(self.labels), float(hist.total) / _clocks.NS_PER_SECOND))
+        samples.append((self.name + '_count', _label_text(self.labels), seen))
+        return samples
+
+    def display_value(self):
+        hist = self.histogram
+        return '{} obs, p50 {}, p99 {}, max {}'.format(
+            hist.count, format_duration(hist.percentile(50)),
+            format_duration(hist.percentile(99)), format_duration(hist.max))
+
+
+class _HistogramTimer(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._start = None
+
+    def __enter__(self):
+        self._start = _clocks.wall_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.histogram.observe_ns(_clocks.wall_ns() - self._start)
+
+    def __call__(self, func):
+        observe_ns = self.histogram.observe_ns
+        clock = _clocks.wall_ns
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe_ns(clock() - start)
+        return wrapper
+
+
+class MetricsRegistry(object):
+    """Named counters, gauges and timing histograms
+
+    Metrics are created on first use and returned as-is afterwards, so
+    notebook cells can be re-run without duplicating them.
+
+    Example
+    -------
+    >>> rows = metrics.counter('rows_processed_total', 'Rows seen', stage='load')
+    >>> rows.inc(len(batch))
+    >>> metrics.start_dumping('/var/run/notebooks/etl.prom', interval=15)
+    >>> hdisplay(metrics)
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._dumper = None
+        self._stop = threading.Event()
+
+    def _get(self, cls, name, help, labels):
+        if not _NAME.match(name):
+            raise ValueError('invalid metric name {!r}'.format(name))
+        for label in labels:
+            if not _LABEL.match(label) or label == 'le':
+                raise ValueError('invalid label name {!r}'.format(label))
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    for (other, _), existing in self._metrics.items():
+                        if other == name and not isinstance(existing, cls):
+                            raise ValueError('{} is already registered as a {}'.format(name, existing.kind))
+                    metric = self._metrics[key] = cls(name, help, labels)
+        elif not isinstance(metric, cls):
+            raise ValueError('{} is already registered as a {}'.format(name, metric.kind))
+        return metric
+
+    def counter(self, name, help='', **labels):
+        """return the Counter `name` with `labels`, creating it on first use"""
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', **labels):
+        """return the Gauge `name` with `labels`, creating it on first use"""
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', **labels):
+        """return the timing Histogram `name` with `labels`, creating it on first use"""
+        return self._get(Histogram, name, help, labels)
+
+    def _sorted(self):
+        with self._lock:
+            items = list(self._metrics.items())
+        return [metric for _, metric in sorted(items, key=lambda item: item[0])]
+
+    def to_prometheus(self):
+        """render every metric in the Prometheus text exposition format"""
+        lines = []
+        described = set()
+        for metric in self._sorted():
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help:
+                    lines.append('# HELP {} {}'.format(metric.name, metric.help.replace('\n', ' ')))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, repr(float(value)) if isinstance(value, float) else value))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """atomically write the exposition text to `path`"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.to_prometheus())
+        os.rename(tmp, path)
+        return path
+
+    def start_dumping(self, path, interval=15.0):
+        """dump to `path` every `interval` seconds from a daemon thread
+
+        A final dump is written by `stop_dumping` and at interpreter exit.
+        """
+        self.stop_dumping()
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.dump(path)
+
+        self._dump_path = path
+        self._dumper = threading.Thread(target=loop, name='ipytools-metrics')
+        self._dumper.daemon = True
+        self._dumper.start()
+        _dumping.add(self)
+        if not _atexit_registered[0]:
+            atexit.register(_stop_all)
+            _atexit_registered[0] = True
+
+    def stop_dumping(self):
+        """stop the background thread and write a final dump"""
+        _dumping.discard(self)
+        if self._dumper is None:
+            return
+        self._stop.set()
+        self._dumper.join()
+        self._dumper = None
+        self.dump(self._dump_path)
+
+    def _repr_html_(self):
+        rows = ''.join(
+            '<tr><th style="text-align:left;">{}</th><td>{}</td><td>{}</td><td style="text-align:left;">{}</td></tr>'.format(
+                escape(metric.name), metric.kind, escape(_label_text(metric.labels)), escape(metric.display_value()))
+            for metric in self._sorted())
+        return ('<table class="ipytools-metrics"><thead><tr><th>metric</th><th>type</th>'
+                '<th>labels</th><th>value</th></tr></thead><tbody>{}</tbody></table>').format(rows)
+
+    def __repr__(self):
+        return self.to_prometheus()
+
+
+def _stop_all():
+    for registry in list(_dumping):
+        registry.stop_dumping()
+
+
+metrics = MetricsRegistry()
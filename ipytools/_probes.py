@@ -0,0 +1,357 @@
+"""Optional measurements that `Timer` takes around its block
+
+A probe is started just before the Timer's clocks and stopped just after
+them.  `stop` returns a dict of results that the Timer stores as attributes
+and `describe` turns those results into the text shown by `Timer.__repr__`.
+asyncio is only imported by TaskProbe, so Python 2 can use the others.
+"""
+import gc
+import os
+import sys
+import types
+
+from . import _clocks
+from ._stats import format_bytes, format_duration
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+# bytes per unit of ru_maxrss: kilobytes on Linux, bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def rss_bytes():
+    """resident set size of this process from /proc/self/statm, or None"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_bytes():
+    """high-water mark of the process' resident set size, or None"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def gc_collections():
+    """total number of collections run by the garbage collector, or None"""
+    if not hasattr(gc, 'get_stats'):
+        return None
+    return sum(generation['collections'] for generation in gc.get_stats())
+
+
+class MemoryProbe(object):
+    """tracemalloc peak and net allocation, RSS before and after, GC runs
+
+    The peak is the highest traced memory above the level at block start.
+    tracemalloc is started for the block when it is not already tracing,
+    which slows allocation-heavy code down while the block runs.
+
+    The growth of the process' RSS high-water mark (`rss_peak_delta`, from
+    `getrusage`) is recorded on every version; it is 0 unless the block
+    pushed RSS past every earlier peak.  The tracemalloc peak and net
+    allocation and the GC collection count need Python 3.4+; on Python 2
+    they are None, so `Timer(memory=True)` reports the RSS figures only.
+    """
+    name = 'Memory'
+
+    def __init__(self):
+        self._started_tracing = False
+        self._traced_start = None
+        self._peak_valid = False
+        self._rss_before = None
+        self._rss_peak = None
+        self._collections = None
+
+    def start(self):
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+                self._peak_valid = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+                self._peak_valid = True
+            self._traced_start = tracemalloc.get_traced_memory()[0]
+        self._collections = gc_collections()
+        self._rss_before = rss_bytes()
+        self._rss_peak = peak_rss_bytes()
+
+    def stop(self):
+        rss_after = rss_bytes()
+        rss_peak = peak_rss_bytes()
+        collections = gc_collections()
+
+        peak = net = None
+        if tracemalloc is not None and self._traced_start is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            net = current - self._traced_start
+            peak = peak - self._traced_start if self._peak_valid else None
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+        return {
+            'memory_peak': peak,
+            'memory_net': net,
+            'rss_before': self._rss_before,
+            'rss_after': rss_after,
+            'rss_peak_delta': (rss_peak - self._rss_peak
+                               if rss_peak is not None and self._rss_peak is not None else None),
+            'gc_collections': (collections - self._collections
+                               if collections is not None else None),
+        }
+
+    @staticmethod
+    def describe(results):
+        fields = []
+        if results['memory_peak'] is not None:
+            fields.append('peak {}'.format(format_bytes(results['memory_peak'])))
+        if results['memory_net'] is not None:
+            fields.append('net {}'.format(format_bytes(results['memory_net'], signed=True)))
+        before, after = results['rss_before'], results['rss_after']
+        if before is not None and after is not None:
+            fields.append('RSS {} -> {} ({})'.format(
+                format_bytes(before), format_bytes(after),
+                format_bytes(after - before, signed=True)))
+        if results['rss_peak_delta'] is not None:
+            fields.append('max RSS {}'.format(format_bytes(results['rss_peak_delta'], signed=True)))
+        if results['gc_collections'] is not None:
+            fields.append('{} GC collections'.format(results['gc_collections']))
+        return ', '.join(fields) or 'unavailable'
+
+
+class GCProbe(object):
+    """garbage collection pauses per generation, from `gc.callbacks`
+
+    Collections in any thread are counted while the block runs.  Needs
+    `gc.callbacks` (Python 3.3+); creating the probe on Python 2 raises
+    RuntimeError instead of timing blocks that always report nothing.
+    """
+    name = 'GC'
+
+    def __init__(self):
+        if not hasattr(gc, 'callbacks'):
+            raise RuntimeError('Timer(gc=True) needs gc.callbacks, available from Python 3.3')
+        self._pauses = {}
+        self._started = None
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._started = _clocks.wall_ns()
+        elif self._started is not None:
+            pause = _clocks.wall_ns() - self._started
+            self._started = None
+            stats = self._pauses.setdefault(info['generation'], {
+                'count': 0, 'total_ns': 0, 'max_ns': 0, 'collected': 0, 'uncollectable': 0})
+            stats['count'] += 1
+            stats['total_ns'] += pause
+            stats['max_ns'] = max(stats['max_ns'], pause)
+            stats['collected'] += info.get('collected', 0)
+            stats['uncollectable'] += info.get('uncollectable', 0)
+
+    def start(self):
+        self._pauses = {}
+        self._started = None
+        gc.callbacks.append(self._callback)
+
+    def stop(self):
+        gc.callbacks.remove(self._callback)
+        return {
+            'gc_pauses': self._pauses,
+            'gc_pause_ns': sum(stats['total_ns'] for stats in self._pauses.values()),
+        }
+
+    @staticmethod
+    def describe(results):
+        pauses = results['gc_pauses']
+        if not pauses:
+            return 'no collections'
+        fields = []
+        for generation in sorted(pauses):
+            stats = pauses[generation]
+            fields.append('gen{} {}x total {} max {} ({} collected)'.format(
+                generation, stats['count'], format_duration(stats['total_ns']),
+                format_duration(stats['max_ns']), stats['collected']))
+        return ', '.join(fields)
+
+
+# asyncio task -> active TaskProbes on it, outermost first
+_tracked_tasks = {}
+_unclosed_steps = []
+_original_run = []
+
+
+def _can_wrap_handles():
+    """True when `asyncio.Handle._run` is the pure-Python method we wrap
+
+    `Handle._run` is private; it has had the same signature from Python 3.4
+    through 3.13.  Loops that run callbacks without it (uvloop) leave the
+    wrapper unused rather than broken.
+    """
+    if sys.version_info < (3, 4) or sys.version_info >= (3, 14):
+        return False
+    from asyncio import events
+    return isinstance(events.Handle.__dict__.get('_run'), types.FunctionType)
+
+
+def _run_tracked(handle):
+    """`asyncio.Handle._run` replacement timing the steps of tracked tasks"""
+    if _unclosed_steps:
+        # a probe started inside a step that ran unwrapped; it ended just
+        # before this handle, as the probe queued a callback to keep the
+        # loop from blocking in between
+        now = _clocks.wall_ns()
+        for state in _unclosed_steps:
+            state.running_ns += now - state.step_start
+            state.steps += 1
+        del _unclosed_steps[:]
+    owner = getattr(handle._callback, '__self__', None)
+    states = _tracked_tasks.get(owner) if owner is not None else None
+    if not states:
+        return _original_run[0](handle)
+    # probes started during this step close it through _unclosed_steps
+    states = list(states)
+    start = _clocks.wall_ns()
+    for state in states:
+        state.step_start = start
+    try:
+        return _original_run[0](handle)
+    finally:
+        end = _clocks.wall_ns()
+        for state in states:
+            if state.active:
+                state.running_ns += end - state.step_start
+                state.steps += 1
+
+
+def _track(task, state):
+    from asyncio import events
+    if not _original_run:
+        _original_run.append(events.Handle._run)
+        events.Handle._run = _run_tracked
+    _tracked_tasks.setdefault(task, []).append(state)
+
+
+def _untrack(task, state):
+    from asyncio import events
+    states = _tracked_tasks.get(task, [])
+    if state in states:
+        states.remove(state)
+    if not states:
+        _tracked_tasks.pop(task, None)
+    if not _tracked_tasks and _original_run:
+        events.Handle._run = _original_run.pop()
+
+
+def completed(value):
+    """an asyncio future already holding `value`; awaiting it does not suspend"""
+    import asyncio
+    future = asyncio.Future()
+    future.set_result(value)
+    return future
+
+
+class TaskProbe(object):
+    """running versus suspended time of the enclosing asyncio task
+
+    Every task step and wakeup goes through `asyncio.Handle._run`, which is
+    wrapped while at least one TaskProbe is active.  Time inside steps of
+    the enclosing task counts as running; the rest of the block's wall time
+    is suspended on awaits or queued behind other callbacks.  Nested probes
+    on the same task are each updated by every step.  A heartbeat scheduled
+    every `lag_interval` seconds measures event loop lag, the delay between
+    when a callback is due and when the loop runs it.
+
+    `Handle._run` is private API, so it is only wrapped on the Python
+    versions it was checked against (3.4 to 3.13); elsewhere running and
+    suspended time are reported unavailable and only loop lag is measured.
+    Event loops that bypass `asyncio.Handle` (e.g. uvloop) report no
+    running time.
+    """
+    name = 'Task'
+
+    def __init__(self, lag_interval=0.01):
+        self.lag_interval = lag_interval
+        self.task = None
+        self.active = False
+        self.running_ns = 0
+        self.steps = 0
+        self.step_start = None
+        self._wrapped = False
+        self._lags = []
+        self._beat = None
+        self._start_ns = None
+
+    def _heartbeat(self, loop, due):
+        self._lags.append(max(0, int((loop.time() - due) * _clocks.NS_PER_SECOND)))
+        due = loop.time() + self.lag_interval
+        self._beat = loop.call_at(due, self._heartbeat, loop, due)
+
+    def start(self):
+        import asyncio
+        current = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+        self.task = current()
+        if self.task is None:
+            raise RuntimeError('Timer(task=True) must run inside an asyncio task')
+        self.active = True
+        self.running_ns = 0
+        self.steps = 0
+        self._lags = []
+        self.step_start = self._start_ns = _clocks.wall_ns()
+        loop = self.task.get_loop() if hasattr(self.task, 'get_loop') else self.task._loop
+        self._wrapped = _can_wrap_handles()
+        if self._wrapped:
+            _track(self.task, self)
+            _unclosed_steps.append(self)
+            loop.call_soon(lambda: None)
+        due = loop.time() + self.lag_interval
+        self._beat = loop.call_at(due, self._heartbeat, loop, due)
+
+    def stop(self):
+        now = _clocks.wall_ns()
+        self.running_ns += now - self.step_start
+        self.steps += 1
+        self.active = False
+        if self in _unclosed_steps:
+            _unclosed_steps.remove(self)
+        if self._wrapped:
+            _untrack(self.task, self)
+        self._beat.cancel()
+        lags = self._lags
+        return {
+            'task_running_ns': self.running_ns if self._wrapped else None,
+            'task_suspended_ns': max(0, now - self._start_ns - self.running_ns) if self._wrapped else None,
+            'task_steps': self.steps if self._wrapped else None,
+            'loop_lag_max_ns': max(lags) if lags else None,
+            'loop_lag_mean_ns': sum(lags) // len(lags) if lags else None,
+        }
+
+    @staticmethod
+    def describe(results):
+        if results['task_running_ns'] is None:
+            text = 'running/suspended unavailable'
+        else:
+            text = 'running {} in {} steps, suspended {}'.format(
+                format_duration(results['task_running_ns']), results['task_steps'],
+                format_duration(results['task_suspended_ns']))
+        if results['loop_lag_max_ns'] is not None:
+            text += ', loop lag mean {} max {}'.format(
+                format_duration(results['loop_lag_mean_ns']),
+                format_duration(results['loop_lag_max_ns']))
+        return text
@@ -0,0 +1,162 @@
+"""Statistical stack sampler behind `Profile`
+
+Samples are taken either from a background thread reading
+`sys._current_frames()` or from a SIGPROF interval timer in the main
+thread.  Each sample walks the frame chain once and increments a counter
+keyed by the tuple of code objects, so the cost per sample is bounded by
+stack depth and nothing is recorded between samples.
+"""
+import os
+import signal
+import sys
+import threading
+
+from . import _clocks
+
+
+def _label(code):
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+class StackSampler(object):
+    """Count sampled Python stacks of one or all threads
+
+    Parameters
+    ----------
+    interval : float
+        seconds between samples
+    all_threads : bool
+        sample every thread instead of only the one that called `start`
+    mode : str
+        'thread' samples from a background thread; 'signal' uses a SIGPROF
+        timer and only works from the main thread (CPU time, not wall time)
+    """
+    def __init__(self, interval=0.005, all_threads=False, mode='thread'):
+        if mode not in ('thread', 'signal'):
+            raise ValueError('mode must be "thread" or "signal"')
+        self.interval = interval
+        self.all_threads = all_threads
+        self.mode = mode
+        self.stacks = {}
+        self.samples = 0
+        self.elapsed_ns = 0
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous_handler = None
+        self._start_ns = None
+        self._base = None
+
+    def _add(self, frame, thread_name=None):
+        base = self._base if thread_name is None else None
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            if frame is base:
+                break
+            frame = frame.f_back
+        codes.reverse()
+        key = (thread_name,) + tuple(codes) if thread_name else tuple(codes)
+        stacks = self.stacks
+        stacks[key] = stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def _sample_threads(self):
+        own = threading.current_thread().ident
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if self.all_threads:
+                self._add(frame, names.get(ident, str(ident)))
+            elif ident == self._target:
+                self._add(frame)
+
+    def _run(self):
+        wait = self._stop.wait
+        while not wait(self.interval):
+            self._sample_threads()
+
+    def _on_signal(self, signum, frame):
+        self._add(frame)
+
+    def start(self, base=None):
+        """start sampling; stacks of the calling thread are cut at frame `base`"""
+        self._target = threading.current_thread().ident
+        self._base = base
+        self._start_ns = _clocks.wall_ns()
+        if self.mode == 'signal':
+            if threading.current_thread().name != 'MainThread':
+                raise ValueError('signal sampling only works in the main thread')
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='ipytools-profile')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        if self.mode == 'signal':
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        else:
+            self._stop.set()
+            self._thread.join()
+        self._base = None
+        self.elapsed_ns = _clocks.wall_ns() - self._start_ns
+
+    def tree(self):
+        """merge the sampled stacks into a nested dict for rendering
+
+        Returns
+        -------
+        root : dict
+            {'name', 'value', 'children'} with `value` in samples
+        """
+        root = {'name': 'all', 'value': 0, 'children': {}}
+        labels = {}
+        for stack, count in self.stacks.items():
+            root['value'] += count
+            node = root
+            for code in stack:
+                if not hasattr(code, 'co_name'):
+                    label = code
+                else:
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = _label(code)
+                child = node['children'].get(label)
+                if child is None:
+                    child = node['children'][label] = {'name': label, 'value': 0, 'children': {}}
+                child['value'] += count
+                node = child
+
+        def freeze(node):
+            children = sorted(node['children'].values(), key=lambda child: -child['value'])
+            return {'name': node['name'], 'value': node['value'],
+                    'children': [freeze(child) for child in children]}
+        return freeze(root)
+
+    def top(self, limit=20):
+        """functions ranked by own samples
+
+        Returns
+        -------
+        rows : list
+            (label, own samples, total samples) tuples, most expensive first
+        """
+        own = {}
+        total = {}
+        for stack, count in self.stacks.items():
+            codes = [code for code in stack if hasattr(code, 'co_name')]
+            if not codes:
+                continue
+            leaf = _label(codes[-1])
+            own[leaf] = own.get(leaf, 0) + count
+            for label in set(_label(code) for code in codes):
+                total[label] = total.get(label, 0) + count
+        rows = [(label, own.get(label, 0), total[label]) for label in total]
+        rows.sort(key=lambda row: (-row[1], -row[2]))
+        return rows[:limit]
@@ -0,0 +1,223 @@
+"""Thread-local span stacks that turn nested `Timer` blocks into a tree"""
+import threading
+
+from ._html import escape
+from ._stats import format_duration
+
+_local = threading.local()
+_roots = {}
+_roots_lock = threading.Lock()
+_generation = [0]
+
+
+class SpanNode(object):
+    """Aggregated timings for every run of a span at one position in the tree
+
+    Attributes
+    ----------
+    name : str
+        span name; siblings with the same name share one node
+    parent : SpanNode or None
+        enclosing span, None for a thread root
+    children : dict
+        child nodes keyed by name
+    order : list
+        child nodes in first-seen order
+    count : int
+        number of completed runs
+    total_ns : int
+        wall time of all runs, including children
+    child_ns : int
+        wall time spent inside child spans
+    path : str
+        ';'-joined names from the outermost span down to this one
+    """
+    __slots__ = ('name', 'parent', 'children', 'order', 'count', 'total_ns', 'child_ns', 'path')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        if parent is None or parent.parent is None:
+            self.path = name if parent is not None else ''
+        else:
+            self.path = '{};{}'.format(parent.path, name)
+        self.children = {}
+        self.order = []
+        self.count = 0
+        self.total_ns = 0
+        self.child_ns = 0
+
+    @property
+    def self_ns(self):
+        """wall time not covered by child spans"""
+        return self.total_ns - self.child_ns
+
+    def child(self, name):
+        """return the child named `name`, creating it on first use"""
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = SpanNode(name, self)
+            self.order.append(node)
+        return node
+
+    def sorted_children(self):
+        """children ordered by total time, most expensive first"""
+        return sorted(self.order, key=lambda node: node.total_ns, reverse=True)
+
+    def __repr__(self):
+        return '<SpanNode {} calls={} total={} self={}>'.format(
+            self.name, self.count, format_duration(self.total_ns),
+            format_duration(self.self_ns))
+
+
+def _thread_root():
+    root = getattr(_local, 'root', None)
+    if root is None or _local.generation != _generation[0]:
+        thread = threading.current_thread()
+        root = _local.root = SpanNode(thread.name)
+        _local.stack = []
+        _local.generation = _generation[0]
+        with _roots_lock:
+            _roots[thread.ident] = root
+    return root
+
+
+def push(name):
+    """open span `name` under the innermost open span of this thread
+
+    Returns
+    -------
+    node : SpanNode
+        node to hand back to `pop`
+    """
+    root = _thread_root()
+    stack = _local.stack
+    parent = stack[-1] if stack else root
+    node = parent.child(name)
+    stack.append(node)
+    return node
+
+
+def pop(node, wall_ns):
+    """close `node` and add `wall_ns` to it and to its parent's child time"""
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        if stack[-1] is node:
+            stack.pop()
+        elif node in stack:
+            # spans closed out of order (interleaved generators or tasks)
+            stack.remove(node)
+    node.count += 1
+    node.total_ns += wall_ns
+    if node.parent is not None:
+        node.parent.child_ns += wall_ns
+
+
+def roots():
+    """span roots of every thread that has run a `Timer`"""
+    with _roots_lock:
+        return list(_roots.values())
+
+
+def reset():
+    """forget every recorded span; open spans keep timing but are detached"""
+    with _roots_lock:
+        _roots.clear()
+        _generation[0] += 1
+
+
+def _walk(node, depth=0):
+    yield node, depth
+    for child in node.sorted_children():
+        for item in _walk(child, depth + 1):
+            yield item
+
+
+def tree_html(nodes, headers, row, title=None, children=None):
+    """render nested nodes as a collapsible HTML table
+
+    Parameters
+    ----------
+    nodes : list
+        top level nodes; each node needs `name` and `sorted_children()`
+    headers : list
+        column headers after the name column
+    row : callable
+        row(node) -> list of cell strings matching `headers`
+    title : str, optional
+        caption above the table
+    children : callable, optional
+        children(node) -> list of child nodes, default node.sorted_children()
+
+    Returns
+    -------
+    html : str
+    """
+    cell = '<span style="display:inline-block;width:90px;text-align:right;">{}</span>'
+    children_of = children or (lambda node: node.sorted_children())
+    name_cell = '<span style="display:inline-block;width:{}px;">{}</span>'
+
+    def render(node, depth):
+        width = max(320 - 16 * depth, 120)
+        summary = name_cell.format(width, escape(node.name)) + ''.join(cell.format(escape(value)) for value in row(node))
+        kids = children_of(node)
+        if not kids:
+            return '<div style="padding-left:{}px;">{}</div>'.format(16 if depth else 0, summary)
+        inner = ''.join(render(child, depth + 1) for child in kids)
+        return """<details {open} style="padding-left:{pad}px;"><summary>{summary}</summary>{inner}</details>""".format(
+            open='open' if depth < 2 else '', pad=16 if depth else 0, summary=summary, inner=inner)
+
+    header = name_cell.format(320, '<b>name</b>') + ''.join(cell.format('<b>{}</b>'.format(h)) for h in headers)
+    caption = '<p><b>{}</b></p>'.format(escape(title)) if title else ''
+    body = ''.join(render(node, 0) for node in nodes)
+    return '<div class="ipytools-tree" style="font-family:courier;">{}<div style="padding-left:16px;">{}</div>{}</div>'.format(
+        caption, header, body)
+
+
+class SpanReport(object):
+    """Aggregated span tree of one or more threads
+
+    Example
+    -------
+    >>> with Timer('pipeline'):
+    ...     with Timer('load'):
+    ...         load()
+    ...     for chunk in chunks:
+    ...         with Timer('transform'):
+    ...             transform(chunk)
+    ...
+    >>> hdisplay(Timer.report())
+    """
+    headers = ['calls', 'total', 'self', '% total']
+
+    def __init__(self, nodes):
+        self.nodes = [node for node in nodes if node.order]
+        # thread roots time nothing themselves; their totals live here so
+        # the shared tree is left untouched
+        self._root_ns = dict((node, sum(child.total_ns for child in node.order)) for node in self.nodes)
+        self.total_ns = sum(self._root_ns.values())
+
+    def _row(self, node):
+        total_ns = self._root_ns.get(node, node.total_ns)
+        share = 100.0 * total_ns / self.total_ns if self.total_ns else 0.0
+        return [
+            node.count or '',
+            format_duration(total_ns),
+            format_duration(node.self_ns) if node.parent is not None else '',
+            '{:.1f}%'.format(share),
+        ]
+
+    def __iter__(self):
+        for root in self.nodes:
+            for node, depth in _walk(root):
+                yield node, depth
+
+    def __repr__(self):
+        lines = ['{:<40}{:>8}{:>12}{:>12}{:>10}'.format('name', *self.headers)]
+        for node, depth in self:
+            name = '  ' * depth + node.name
+            lines.append('{:<40}{:>8}{:>12}{:>12}{:>10}'.format(name, *self._row(node)))
+        return '\n'.join(lines)
+
+    def _repr_html_(self):
+        return tree_html(self.nodes, self.headers, self._row, title='Timer spans')
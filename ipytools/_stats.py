@@ -0,0 +1,228 @@
+"""Small, dependency-free summary statistics for timing samples"""
+import math
+import random
+
+
+def mean(values):
+    """arithmetic mean of a non-empty sequence"""
+    return float(sum(values)) / len(values)
+
+
+def stddev(values):
+    """sample standard deviation; 0.0 for fewer than two values"""
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mu = mean(values)
+    return math.sqrt(sum((v - mu) ** 2 for v in values) / (n - 1))
+
+
+def percentile(sorted_values, q):
+    """linearly interpolated percentile
+
+    Parameters
+    ----------
+    sorted_values : list
+        values sorted lowest to highest
+    q : float
+        percentile in [0, 100]
+
+    Returns
+    -------
+    value : float
+    """
+    if not sorted_values:
+        raise ValueError('percentile of an empty sequence')
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def median(values):
+    """median of a non-empty sequence"""
+    return percentile(sorted(values), 50)
+
+
+def outliers(sorted_values):
+    """count values outside Tukey's fences
+
+    Parameters
+    ----------
+    sorted_values : list
+        values sorted lowest to highest
+
+    Returns
+    -------
+    counts : tuple
+        (mild, severe) where mild values lie beyond 1.5 IQR of the quartiles
+        and severe values lie beyond 3 IQR
+    """
+    q1 = percentile(sorted_values, 25)
+    q3 = percentile(sorted_values, 75)
+    iqr = q3 - q1
+    mild = severe = 0
+    for value in sorted_values:
+        if value < q1 - 3 * iqr or value > q3 + 3 * iqr:
+            severe += 1
+        elif value < q1 - 1.5 * iqr or value > q3 + 1.5 * iqr:
+            mild += 1
+    return mild, severe
+
+
+def summarize(values):
+    """summary statistics used by benchmark reports
+
+    Parameters
+    ----------
+    values : list
+        non-empty list of samples
+
+    Returns
+    -------
+    summary : dict
+        min, max, median, mean, stddev, p95, p99, mild_outliers, severe_outliers
+    """
+    ordered = sorted(values)
+    mild, severe = outliers(ordered)
+    return {
+        'min': ordered[0],
+        'max': ordered[-1],
+        'median': percentile(ordered, 50),
+        'mean': mean(ordered),
+        'stddev': stddev(ordered),
+        'p95': percentile(ordered, 95),
+        'p99': percentile(ordered, 99),
+        'mild_outliers': mild,
+        'severe_outliers': severe,
+    }
+
+
+def _ranks(values):
+    """1-based ranks with ties averaged, plus the tie correction term"""
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    ties = 0.0
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        rank = (i + j) / 2.0 + 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = rank
+        size = j - i + 1
+        ties += size ** 3 - size
+        i = j + 1
+    return ranks, ties
+
+
+def mann_whitney(a, b):
+    """two-sided Mann-Whitney U test, normal approximation with tie correction
+
+    Parameters
+    ----------
+    a, b : list
+        independent samples
+
+    Returns
+    -------
+    result : tuple
+        (U statistic of `a`, two-sided p-value)
+    """
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        raise ValueError('mann_whitney needs two non-empty samples')
+    ranks, ties = _ranks(list(a) + list(b))
+    u1 = sum(ranks[:n1]) - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    variance = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u1, 1.0
+    delta = u1 - n1 * n2 / 2.0
+    z = (abs(delta) - 0.5) / math.sqrt(variance)
+    p = math.erfc(max(z, 0.0) / math.sqrt(2))
+    return u1, min(p, 1.0)
+
+
+def bootstrap_ratio(baseline, current, statistic=median, resamples=2000,
+                    confidence=0.95, seed=0):
+    """bootstrap confidence interval of statistic(current) / statistic(baseline)
+
+    Parameters
+    ----------
+    baseline, current : list
+        independent samples
+    statistic : callable
+        summary statistic, median by default
+    resamples : int
+        number of bootstrap resamples
+    confidence : float
+        interval coverage
+    seed : int
+        seed for a private random generator, for reproducible intervals
+
+    Returns
+    -------
+    interval : tuple
+        (low, high) ratio bounds
+    """
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(resamples):
+        base = statistic([rng.choice(baseline) for _ in baseline])
+        new = statistic([rng.choice(current) for _ in current])
+        ratios.append(float(new) / base if base else float('inf'))
+    ratios.sort()
+    tail = (1 - confidence) / 2 * 100
+    return percentile(ratios, tail), percentile(ratios, 100 - tail)
+
+
+def format_pvalue(p):
+    """'p<0.001', 'p<0.01', 'p<0.05' or 'p=0.23'"""
+    for threshold in (0.001, 0.01, 0.05):
+        if p < threshold:
+            return 'p<{:g}'.format(threshold)
+    return 'p={:.2f}'.format(p)
+
+
+def format_duration(ns):
+    """format a nanosecond duration with a readable unit
+
+    Parameters
+    ----------
+    ns : int or float
+        duration in nanoseconds
+
+    Returns
+    -------
+    string : str
+        e.g. '812 ns', '1.23 us', '45.6 ms', '2.01 s'
+    """
+    for unit, scale in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if abs(ns) >= scale:
+            return '{:.3g} {}'.format(ns / scale, unit)
+    return '{:.3g} ns'.format(ns)
+
+
+def format_bytes(size, signed=False):
+    """format a byte count with a binary unit
+
+    Parameters
+    ----------
+    size : int
+        number of bytes
+    signed : bool
+        always prefix the sign, for deltas
+
+    Returns
+    -------
+    string : str
+        e.g. '812 B', '1.2 MiB', '+3.4 KiB'
+    """
+    sign = '+' if signed and size >= 0 else ''
+    for unit, scale in (('GiB', 1 << 30), ('MiB', 1 << 20), ('KiB', 1 << 10)):
+        if abs(size) >= scale:
+            return '{}{:.3g} {}'.format(sign, float(size) / scale, unit)
+    return '{}{} B'.format(sign, size)
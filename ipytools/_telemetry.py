@@ -0,0 +1,410 @@
+"""Per-cell execution telemetry stored in SQLite
+
+`CellTelemetry` hooks IPython's pre_run_cell / post_run_cell events and
+writes one row per executed cell: wall and CPU time, RSS change, growth of
+the process' RSS high-water mark and the number of bytes the cell printed
+or displayed.  The high-water mark only moves when a cell goes past every
+earlier peak, so this understates a cell's own peak above its starting RSS.  Rows are keyed by notebook and by a hash of the cell source,
+so the same cell can be followed across sessions.  The database lives in
+~/.ipython/ipytools/telemetry.sqlite, or at IPYTOOLS_TELEMETRY_DB.
+
+Recording starts when ipytools is imported inside an IPython shell, or
+when the shell loads the `ipytools` or `cellstats` extension; set
+IPYTOOLS_TELEMETRY=0 to keep `import ipytools` from starting it.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import uuid
+
+from . import _clocks, _probes
+from ._html import escape
+from ._stats import format_bytes, format_duration
+
+TELEMETRY_DB_ENV = 'IPYTOOLS_TELEMETRY_DB'
+TELEMETRY_ENV = 'IPYTOOLS_TELEMETRY'
+DEFAULT_DB = '~/.ipython/ipytools/telemetry.sqlite'
+
+# the CellTelemetry recording this process' shell, see `enable`
+_active = [None]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cells (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    notebook TEXT NOT NULL,
+    cell_hash TEXT NOT NULL,
+    execution_count INTEGER,
+    started REAL NOT NULL,
+    wall_ns INTEGER NOT NULL,
+    cpu_ns INTEGER NOT NULL,
+    rss_delta INTEGER,
+    peak_delta INTEGER,
+    output_bytes INTEGER NOT NULL,
+    error INTEGER NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS cells_cell ON cells (notebook, cell_hash);
+CREATE INDEX IF NOT EXISTS cells_session ON cells (session);
+"""
+
+
+def db_path():
+    """telemetry database path, its directory created on first use"""
+    path = os.path.expanduser(os.environ.get(TELEMETRY_DB_ENV, DEFAULT_DB))
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    return path
+
+
+def connect(path=None):
+    """open the telemetry database, creating the schema if needed"""
+    connection = sqlite3.connect(path or db_path(), timeout=5, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def cell_hash(source):
+    """short stable hash of a cell's source, ignoring surrounding whitespace"""
+    source = source.strip()
+    if not isinstance(source, bytes):
+        # text; a Python 2 str is already bytes and may hold non-ASCII
+        source = source.encode('utf-8')
+    return hashlib.sha1(source).hexdigest()[:16]
+
+
+def notebook_key(shell):
+    """name identifying the running notebook without contacting the server
+
+    Tries the notebook path IPython stores as `__session__`, then the
+    IPYTOOLS_NOTEBOOK and JPY_SESSION_NAME environment variables, then the
+    kernel id from the connection file.
+    """
+    session = shell.user_ns.get('__session__') if shell is not None else None
+    if session:
+        return session
+    for name in ('IPYTOOLS_NOTEBOOK', 'JPY_SESSION_NAME'):
+        if os.environ.get(name):
+            return os.environ[name]
+    config = getattr(shell, 'config', None) or {}
+    connection_file = config.get('IPKernelApp', {}).get('connection_file')
+    if connection_file:
+        return 'kernel:' + os.path.basename(connection_file).replace('kernel-', '').split('.')[0]
+    return 'ipython'
+
+
+class _CountingStream(object):
+    """proxy of a text stream that counts the characters written through it"""
+    def __init__(self, stream):
+        self._stream = stream
+        self.written = 0
+
+    def write(self, text):
+        self.written += len(text)
+        return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class CellTelemetry(object):
+    """Record per-cell telemetry of an IPython shell into SQLite
+
+    Parameters
+    ----------
+    shell : InteractiveShell
+    path : str, optional
+        database file, see `db_path`
+
+    Example
+    -------
+    >>> telemetry = CellTelemetry(get_ipython())
+    >>> telemetry.register()
+    """
+    def __init__(self, shell, path=None):
+        self.shell = shell
+        self.path = path or db_path()
+        self.session = uuid.uuid4().hex[:12]
+        self._connection = None
+        self._start = None
+        self._streams = None
+        self._display_bytes = 0
+        self._registered = False
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = connect(self.path)
+        return self._connection
+
+    def register(self):
+        """start recording every executed cell"""
+        if self._registered:
+            return
+        self._registered = True
+        events = self.shell.events
+        events.register('pre_run_cell', self.pre_run_cell)
+        events.register('post_run_cell', self.post_run_cell)
+        publisher = self.shell.display_pub
+        if not hasattr(publisher, '_ipytools_publish'):
+            publisher._ipytools_publish = publisher.publish
+            publisher.publish = self._publish
+
+    def unregister(self):
+        """stop recording"""
+        self._registered = False
+        events = self.shell.events
+        for name, callback in (('pre_run_cell', self.pre_run_cell),
+                               ('post_run_cell', self.post_run_cell)):
+            try:
+                events.unregister(name, callback)
+            except ValueError:
+                pass
+        publisher = self.shell.display_pub
+        if hasattr(publisher, '_ipytools_publish'):
+            publisher.publish = publisher._ipytools_publish
+            del publisher._ipytools_publish
+        self._restore_streams()
+
+    def _publish(self, data, *args, **kwargs):
+        if self._start is not None:
+            self._display_bytes += sum(len(value) if isinstance(value, str) else len(json.dumps(value))
+                                       for value in (data or {}).values())
+        return self.shell.display_pub._ipytools_publish(data, *args, **kwargs)
+
+    def _restore_streams(self):
+        if self._streams is None:
+            return 0
+        written = 0
+        for name, proxy in zip(('stdout', 'stderr'), self._streams):
+            written += proxy.written
+            if getattr(sys, name) is proxy:
+                setattr(sys, name, proxy._stream)
+        self._streams = None
+        return written
+
+    def pre_run_cell(self, *args):
+        """IPython callback; `args` is empty before IPython 7"""
+        self._restore_streams()
+        self._streams = (_CountingStream(sys.stdout), _CountingStream(sys.stderr))
+        sys.stdout, sys.stderr = self._streams
+        self._display_bytes = 0
+        self._rss = _probes.rss_bytes()
+        self._peak = _probes.peak_rss_bytes()
+        self._execution_count = getattr(self.shell, 'execution_count', None)
+        # before IPython 7 the hooks get no result, and sys.last_value
+        # keeps the last error until a new one replaces it
+        self._last_value = getattr(sys, 'last_value', None)
+        self._started = time.time()
+        self._cpu = _clocks.process_ns()
+        self._start = _clocks.wall_ns()
+
+    def post_run_cell(self, *args):
+        """IPython callback; `args` holds the ExecutionResult from IPython 7"""
+        wall = _clocks.wall_ns()
+        cpu = _clocks.process_ns()
+        if self._start is None:
+            return
+        wall -= self._start
+        cpu -= self._cpu
+        self._start = None
+        output = self._restore_streams() + self._display_bytes
+
+        result = args[0] if args else None
+        info = getattr(result, 'info', None)
+        source = getattr(info, 'raw_cell', None)
+        if source is None:
+            history = getattr(self.shell, 'history_manager', None)
+            raw = getattr(history, 'input_hist_raw', None)
+            source = raw[-1] if raw else ''
+        if result is not None:
+            error = 0 if result.success else 1
+            if result.result is not None:
+                output += len(repr(result.result))
+        else:
+            last_value = getattr(sys, 'last_value', None)
+            error = 1 if last_value is not None and last_value is not self._last_value else 0
+
+        rss = _probes.rss_bytes()
+        peak = _probes.peak_rss_bytes()
+        row = (self.session, notebook_key(self.shell), cell_hash(source),
+               self._execution_count, self._started, wall, cpu,
+               rss - self._rss if None not in (rss, self._rss) else None,
+               peak - self._peak if None not in (peak, self._peak) else None,
+               output, error, source[:2000])
+        try:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT INTO cells (session, notebook, cell_hash, execution_count, started,'
+                    ' wall_ns, cpu_ns, rss_delta, peak_delta, output_bytes, error, source)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+        except sqlite3.Error as e:
+            sys.stderr.write('ipytools telemetry not recorded: {}\n'.format(e))
+
+    def report(self, sort='wall', limit=10, history=False, notebook=None):
+        """slowest or most memory-hungry cells
+
+        Parameters
+        ----------
+        sort : str
+            'wall', 'cpu', 'memory' (growth of the RSS high-water mark) or
+            'output'
+        limit : int
+            number of cells to show
+        history : bool
+            aggregate every recorded session instead of this one
+        notebook : str, optional
+            restrict `history` to one notebook key
+
+        Returns
+        -------
+        report : CellStatsReport
+        """
+        return CellStatsReport.query(self.connection, self.session, sort=sort,
+                                     limit=limit, history=history, notebook=notebook)
+
+
+def enable(shell):
+    """record every cell `shell` runs and return the CellTelemetry doing it
+
+    There is one recorder per process, shared by `import ipytools` and the
+    `ipytools` and `cellstats` extensions, so cells are never counted twice.
+    """
+    telemetry = _active[0]
+    if telemetry is None or telemetry.shell is not shell:
+        if telemetry is not None:
+            telemetry.unregister()
+        telemetry = _active[0] = CellTelemetry(shell)
+    telemetry.register()
+    return telemetry
+
+
+def enable_in_ipython():
+    """`enable` for the running IPython shell, if any; called by `import ipytools`
+
+    Does nothing outside IPython, without importing it, and when
+    IPYTOOLS_TELEMETRY is 0.
+    """
+    if os.environ.get(TELEMETRY_ENV, '1') == '0' or 'IPython' not in sys.modules:
+        return None
+    shell = sys.modules['IPython'].get_ipython()
+    if shell is None or not hasattr(shell, 'events'):
+        return None
+    return enable(shell)
+
+
+_SORT_COLUMNS = {
+    'wall': 'wall_ns',
+    'cpu': 'cpu_ns',
+    'memory': 'peak_delta',
+    'output': 'output_bytes',
+}
+
+
+class CellStatsReport(object):
+    """Top cells of one session, or of every recorded session
+
+    In history mode each row is one (notebook, cell hash) pair with its
+    run count, mean and latest wall time and the ratio of the latest run
+    to the mean of the earlier runs, so regressing cells stand out.  The
+    grouping runs in SQLite, so only `limit` rows reach Python.
+    """
+    def __init__(self, rows, sort, history):
+        self.rows = rows
+        self.sort = sort
+        self.history = history
+
+    @classmethod
+    def query(cls, connection, session, sort='wall', limit=10, history=False, notebook=None):
+        if sort not in _SORT_COLUMNS:
+            raise ValueError('sort must be one of {}'.format(', '.join(sorted(_SORT_COLUMNS))))
+        column = _SORT_COLUMNS[sort]
+        fields = ('notebook', 'cell_hash', 'execution_count', 'started', 'wall_ns',
+                  'cpu_ns', 'rss_delta', 'peak_delta', 'output_bytes', 'error', 'source')
+        select = 'SELECT {} FROM cells'.format(', '.join(fields))
+        if not history:
+            cursor = connection.execute(
+                select + ' WHERE session = ? ORDER BY {} DESC LIMIT ?'.format(column), (session, limit))
+            return cls([dict(zip(fields, row)) for row in cursor], sort, history)
+
+        where, params = ('WHERE notebook = ?', (notebook,)) if notebook else ('', ())
+        cursor = connection.execute(
+            'SELECT g.notebook, g.cell_hash, g.runs, g.wall_ns, g.cpu_ns, g.peak_delta,'
+            ' g.output_bytes, g.wall_sum, c.wall_ns, c.source'
+            ' FROM (SELECT notebook, cell_hash, COUNT(*) AS runs, AVG(wall_ns) AS wall_ns,'
+            '       AVG(cpu_ns) AS cpu_ns, MAX(peak_delta) AS peak_delta,'
+            '       MAX(output_bytes) AS output_bytes, SUM(wall_ns) AS wall_sum, MAX(id) AS latest'
+            '       FROM cells {} GROUP BY notebook, cell_hash) AS g'
+            ' JOIN cells AS c ON c.id = g.latest'
+            ' ORDER BY g.{} DESC LIMIT ?'.format(where, column), params + (limit,))
+        rows = []
+        for name, digest, runs, wall, cpu, peak, output, wall_sum, latest, source in cursor:
+            # mean of the runs before the latest one
+            previous = float(wall_sum - latest) / (runs - 1) if runs > 1 else None
+            rows.append({
+                'notebook': name,
+                'cell_hash': digest,
+                'runs': runs,
+                'wall_ns': int(wall),
+                'cpu_ns': int(cpu),
+                'peak_delta': peak,
+                'output_bytes': output,
+                'latest_ns': latest,
+                'trend': latest / previous if previous else None,
+                'source': source,
+            })
+        return cls(rows, sort, history)
+
+    @staticmethod
+    def _first_line(source):
+        lines = [line for line in (source or '').splitlines() if line.strip()]
+        text = lines[0].strip() if lines else ''
+        return text[:60] + ('...' if len(text) > 60 or len(lines) > 1 else '')
+
+    def _cells(self, row):
+        peak = row['peak_delta']
+        cells = [row['notebook'], row['cell_hash'][:8]]
+        if self.history:
+            cells += [row['runs'], format_duration(row['wall_ns']), format_duration(row['latest_ns']),
+                      '{:.2f}x'.format(row['trend']) if row['trend'] else '']
+        else:
+            cells += [row['execution_count'], format_duration(row['wall_ns'])]
+        cells += [format_duration(row['cpu_ns']), format_bytes(peak) if peak is not None else 'n/a',
+                  format_bytes(row['output_bytes']), self._first_line(row['source'])]
+        return cells
+
+    def _headers(self):
+        if self.history:
+            middle = ['runs', 'mean wall', 'latest wall', 'latest / before']
+        else:
+            middle = ['cell', 'wall']
+        return ['notebook', 'hash'] + middle + ['cpu', 'RSS high-water +', 'output', 'source']
+
+    def _title(self):
+        scope = 'all sessions' if self.history else 'this session'
+        return 'Top {} cells by {} ({})'.format(len(self.rows), self.sort, scope)
+
+    def __repr__(self):
+        lines = [self._title()]
+        for row in self.rows:
+            lines.append('  '.join(str(cell) for cell in self._cells(row)))
+        return '\n'.join(lines)
+
+    def _repr_html_(self):
+        head = ''.join('<th>{}</th>'.format(header) for header in self._headers())
+        body = []
+        for row in self.rows:
+            cells = self._cells(row)
+            source = '<td style="text-align:left;" title="{}"><code>{}</code></td>'.format(
+                escape(row['source'] or ''), escape(cells[-1]))
+            trend = row.get('trend')
+            style = ' style="color:#b00;"' if trend and trend > 1.25 else ''
+            body.append('<tr{}>{}{}</tr>'.format(
+                style, ''.join('<td>{}</td>'.format(escape(cell)) for cell in cells[:-1]), source))
+        return '<table class="ipytools-cellstats"><caption>{}</caption><thead><tr>{}</tr></thead><tbody>{}</tbody></table>'.format(
+            self._title(), head, ''.join(body))
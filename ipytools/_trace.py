@@ -0,0 +1,273 @@
+"""Session-wide trace of completed `Timer` spans
+
+Tracing is off until `start` is called, or until the process starts with
+IPYTOOLS_TRACE_DIR pointing at an existing directory.  While it is on,
+every completed Timer appends one Chrome Trace Event ("ph": "X") as a
+line of JSON to a per-process spool file.  Lines are written straight to
+the file descriptor, so nothing accumulates in memory and forked workers
+never inherit unflushed buffers.  Spool files live in one session
+directory that child processes find through IPYTOOLS_TRACE_DIR, and the
+exporters stream them into Chrome Trace JSON or collapsed-stack text.
+"""
+import atexit
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+TRACE_DIR_ENV = 'IPYTOOLS_TRACE_DIR'
+
+_spool = {'pid': None, 'fd': None, 'generation': 0}
+_spool_lock = threading.Lock()
+_local = threading.local()
+# directory created by `start` in this process, deleted by `stop` or at exit
+_owned = {'pid': None, 'directory': None}
+_atexit_registered = [False]
+
+enabled = os.path.isdir(os.environ.get(TRACE_DIR_ENV) or '')
+
+
+def session_dir():
+    """directory holding this session's spool files, None when tracing is off"""
+    directory = os.environ.get(TRACE_DIR_ENV)
+    return directory if directory and os.path.isdir(directory) else None
+
+
+def start(directory=None):
+    """turn tracing on and return the session directory
+
+    Parameters
+    ----------
+    directory : str, optional
+        directory for the spool files; it is kept by `stop`.  By default a
+        temporary directory is created and deleted by `stop` or at exit.
+        Child processes started afterwards inherit it through
+        IPYTOOLS_TRACE_DIR.
+    """
+    global enabled
+    with _spool_lock:
+        if directory is None:
+            directory = session_dir()
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='ipytools-trace-')
+            _owned['pid'], _owned['directory'] = os.getpid(), directory
+            if not _atexit_registered[0]:
+                atexit.register(_cleanup)
+                _atexit_registered[0] = True
+        elif not os.path.isdir(directory):
+            os.makedirs(directory)
+        os.environ[TRACE_DIR_ENV] = directory
+        enabled = True
+    return directory
+
+
+def _close_spool():
+    if _spool['fd'] is not None and _spool['pid'] == os.getpid():
+        os.close(_spool['fd'])
+    _spool['pid'] = _spool['fd'] = None
+    _spool['generation'] += 1
+
+
+def stop():
+    """turn tracing off; a temporary session directory is deleted with its spans
+
+    Export the trace before stopping if you want to keep it.
+    """
+    global enabled
+    with _spool_lock:
+        enabled = False
+        _close_spool()
+        directory = os.environ.pop(TRACE_DIR_ENV, None)
+        if directory is not None and directory == _owned['directory'] and _owned['pid'] == os.getpid():
+            shutil.rmtree(directory, ignore_errors=True)
+            _owned['pid'] = _owned['directory'] = None
+
+
+def _cleanup():
+    if _owned['directory'] is not None and _owned['pid'] == os.getpid():
+        shutil.rmtree(_owned['directory'], ignore_errors=True)
+
+
+def _spool_fd():
+    """this process's spool file descriptor; call with `_spool_lock` held"""
+    pid = os.getpid()
+    if _spool['pid'] != pid:
+        directory = session_dir()
+        if directory is None:
+            # stopped while this span was open
+            return None
+        path = os.path.join(directory, '{}.jsonl'.format(pid))
+        _spool['fd'] = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        _spool['pid'] = pid
+    return _spool['fd']
+
+
+def _write(event):
+    line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+    # held until the write is done, so `stop` or `clear` cannot close the fd
+    # (and a new file reuse its number) in between
+    with _spool_lock:
+        fd = _spool_fd()
+        if fd is not None:
+            os.write(fd, line)
+
+
+def _reset_lock():
+    global _spool_lock
+    # a fork while another thread held the lock would leave it locked forever
+    _spool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
+
+
+def _cell():
+    """execution count of the running IPython cell, if IPython is loaded"""
+    if 'IPython' not in sys.modules:
+        return None
+    shell = sys.modules['IPython'].get_ipython()
+    return getattr(shell, 'execution_count', None)
+
+
+def record(name, start_ns, wall_ns, stack, args=None):
+    """append one completed span to the spool
+
+    Parameters
+    ----------
+    name : str
+        span name
+    start_ns : int
+        wall clock reading when the span started
+    wall_ns : int
+        span duration in nanoseconds
+    stack : str
+        ';'-joined names of the enclosing spans and this one
+    args : dict, optional
+        extra fields shown by trace viewers
+    """
+    if not enabled:
+        return
+    pid = os.getpid()
+    tid = threading.current_thread().ident
+    if getattr(_local, 'key', None) != (pid, _spool['generation']):
+        _local.key = (pid, _spool['generation'])
+        _write({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                'args': {'name': threading.current_thread().name}})
+    event_args = {'stack': stack}
+    cell = _cell()
+    if cell is not None:
+        event_args['cell'] = cell
+    if args:
+        event_args.update(args)
+    _write({'name': name, 'cat': 'timer', 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': start_ns / 1e3, 'dur': wall_ns / 1e3, 'args': event_args})
+
+
+def _spool_files(directory=None):
+    directory = directory or session_dir()
+    if not directory:
+        raise RuntimeError('tracing is off; call Timer.start_trace() before running the Timer blocks')
+    return sorted(glob.glob(os.path.join(directory, '*.jsonl')))
+
+
+def _lines(files):
+    for path in files:
+        with open(path) as spool:
+            for line in spool:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def export_chrome(path, directory=None):
+    """stream every spooled span into a Chrome Trace Event JSON file
+
+    Parameters
+    ----------
+    path : str
+        output file, loadable by chrome://tracing, Perfetto or speedscope
+    directory : str, optional
+        session directory to read, defaults to the current session
+
+    Returns
+    -------
+    count : int
+        number of events written
+    """
+    count = 0
+    with open(path, 'w') as out:
+        out.write('{"displayTimeUnit":"ns","traceEvents":[\n')
+        for line in _lines(_spool_files(directory)):
+            if count:
+                out.write(',\n')
+            out.write(line)
+            count += 1
+        out.write('\n]}\n')
+    return count
+
+
+def collapsed_stacks(directory=None):
+    """aggregate self time per stack from the spooled spans
+
+    Children complete before their parent, so each span's child time is
+    summed while streaming and subtracted when the parent arrives.
+
+    Returns
+    -------
+    stacks : dict
+        'process;thread;span;...' -> self time in nanoseconds
+    """
+    stacks = {}
+    threads = {}
+    pending = {}
+    for line in _lines(_spool_files(directory)):
+        event = json.loads(line)
+        key = (event['pid'], event['tid'])
+        if event['ph'] == 'M':
+            threads[key] = event['args']['name']
+            continue
+        stack = event['args']['stack']
+        dur_ns = int(round(event['dur'] * 1e3))
+        self_ns = dur_ns - pending.pop(key + (stack,), 0)
+        parent = stack.rsplit(';', 1)[0] if ';' in stack else None
+        if parent is not None:
+            pending[key + (parent,)] = pending.get(key + (parent,), 0) + dur_ns
+        prefix = 'pid {};{}'.format(event['pid'], threads.get(key, event['tid']))
+        frame = '{};{}'.format(prefix, stack)
+        stacks[frame] = stacks.get(frame, 0) + max(self_ns, 0)
+    return stacks
+
+
+def export_collapsed(path, directory=None):
+    """write collapsed-stack text for flamegraph.pl or speedscope
+
+    Parameters
+    ----------
+    path : str
+        output file; one 'frame;frame;frame self_ns' line per stack
+    directory : str, optional
+        session directory to read, defaults to the current session
+
+    Returns
+    -------
+    count : int
+        number of distinct stacks written
+    """
+    stacks = collapsed_stacks(directory)
+    with open(path, 'w') as out:
+        for stack in sorted(stacks):
+            out.write('{} {}\n'.format(stack, stacks[stack]))
+    return len(stacks)
+
+
+def clear():
+    """delete every spool file of the current session"""
+    with _spool_lock:
+        _close_spool()
+    if session_dir() is not None:
+        for path in _spool_files():
+            os.remove(path)
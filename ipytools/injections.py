@@ -1,10 +1,9 @@
 """sub-module to inject functionality into ipython notebook"""
 
-from IPython.display import HTML
-
 def toggle_input_cells():
     """ Add toggle button to hide and unhide code cells in live ipynb session
     """
+    from IPython.display import HTML
     return HTML('''<script>
     code_show=true; 
     function code_toggle() {
@@ -0,0 +1,158 @@
+import re
+
+from IPython.core.magic import Magics, magics_class, cell_magic
+from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
+from IPython.core.error import UsageError
+
+from ipytools import Timer, hdisplay
+from ipytools._bench import StatementLoop
+
+
+@magics_class
+class BenchMagic(Magics):
+    """Magic Class for `%%bench` and `%%abtest` magics.  Specifies arguments and argument handling"""
+    @magic_arguments()
+    @argument(
+        '-s', '--setup', default=None,
+            help='statement run once in the user namespace before benchmarking; quote it if it has spaces'
+    )
+    @argument(
+        '-n', '--number', type=int, default=None,
+            help='loops per sample; calibrated automatically when omitted'
+    )
+    @argument(
+        '-r', '--repeat', type=int, default=20,
+            help='number of samples to collect'
+    )
+    @argument(
+        '-w', '--warmup', type=int, default=1,
+            help='number of discarded warmup samples'
+    )
+    @argument(
+        '--target', type=float, default=0.02,
+            help='calibration target per sample, in seconds'
+    )
+    @argument(
+        '-o', '--output', default=None,
+            help='store the BenchResult in this user variable'
+    )
+    @cell_magic
+    def bench(self, line, cell):
+        """`%%bench` benchmarks a cell and displays summary statistics
+
+        The cell is compiled once into a loop, like `timeit`, so names it
+        assigns stay local to the benchmark.  The loop count is calibrated
+        and the result is rendered as an HTML table through `hdisplay`.
+
+        Examples
+        --------
+        >>> %%bench -r 30
+        ... sorted(data)
+
+        >>> %%bench -o result -s "import numpy as np; x = np.arange(10 ** 6)"
+        ... x.sum()
+        """
+        args = parse_argstring(self.bench, line)
+        namespace = self.shell.user_ns
+
+        self._run_setup(args.setup)
+        run = self._compile_block(cell, '<bench>')
+
+        result = Timer.bench(run, number=args.number, repeat=args.repeat,
+                             warmup=args.warmup, target=args.target,
+                             name='%%bench')
+        if args.output:
+            namespace[args.output] = result
+        hdisplay(result)
+
+    def _run_setup(self, setup):
+        """run the -s statement in the user namespace; UsageError if it fails"""
+        if not setup:
+            return
+        if len(setup) > 1 and setup[0] == setup[-1] and setup[0] in '"\'':
+            # parse_argstring keeps the quotes around the statement
+            setup = setup[1:-1]
+        result = self.shell.run_cell(setup, store_history=False)
+        # IPython < 4 returns None and no success flag
+        if result is not None and not result.success:
+            raise UsageError('setup statement failed, not benchmarking')
+
+    def _compile_block(self, block, filename):
+        source = self.shell.input_transformer_manager.transform_cell(block)
+        return StatementLoop(source, self.shell.user_ns, filename, self.shell.compile)
+
+    @magic_arguments()
+    @argument(
+        '-s', '--setup', default=None,
+            help='statement run once in the user namespace before benchmarking; quote it if it has spaces'
+    )
+    @argument(
+        '-r', '--rounds', type=int, default=30,
+            help='number of interleaved rounds, one sample per variant each'
+    )
+    @argument(
+        '-n', '--number', type=int, default=None,
+            help='loops per sample; calibrated on the slower variant when omitted'
+    )
+    @argument(
+        '-w', '--warmup', type=int, default=1,
+            help='number of discarded warmup rounds'
+    )
+    @argument(
+        '--target', type=float, default=0.02,
+            help='calibration target per sample, in seconds'
+    )
+    @argument(
+        '--names', nargs=2, default=['A', 'B'], metavar=('A', 'B'),
+            help='labels of the two variants'
+    )
+    @argument(
+        '--seed', type=int, default=None,
+            help='seed for the randomized round order'
+    )
+    @argument(
+        '-o', '--output', default=None,
+            help='store the ABResult in this user variable'
+    )
+    @cell_magic
+    def abtest(self, line, cell):
+        """`%%abtest` compares two code variants run in interleaved, random order
+
+        The cell holds two blocks separated by a line of three or more dashes.
+        Every round runs one sample of each block in a shuffled order, so warm
+        caches and thermal drift do not favour either variant.  The speedup of
+        B over A is reported with a bootstrap confidence interval.
+
+        Examples
+        --------
+        >>> %%abtest -r 50 -s "import random; data = random.sample(range(10 ** 5), 10 ** 5)"
+        ... sorted(data, key=lambda x: x)
+        ... ---
+        ... sorted(data)
+        """
+        args = parse_argstring(self.abtest, line)
+        blocks = re.split(r'(?m)^\s*-{3,}\s*$', cell)
+        if len(blocks) != 2 or not all(block.strip() for block in blocks):
+            raise UsageError('%%abtest needs two code blocks separated by a "---" line')
+
+        self._run_setup(args.setup)
+
+        variants = [self._compile_block(block, '<abtest-{}>'.format(name))
+                    for block, name in zip(blocks, args.names)]
+        result = Timer.abtest(variants[0], variants[1], rounds=args.rounds,
+                              number=args.number, warmup=args.warmup,
+                              target=args.target, names=tuple(args.names),
+                              seed=args.seed)
+        if args.output:
+            self.shell.user_ns[args.output] = result
+        hdisplay(result)
+
+
+def load_ipython_extension(ip):
+    """Load the extension in IPython."""
+    global _loaded
+    if not _loaded:
+        ip.register_magics(BenchMagic)
+        _loaded = True
+
+_loaded = False
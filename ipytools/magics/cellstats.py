@@ -0,0 +1,80 @@
+from IPython.core.magic import Magics, magics_class, line_magic
+from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
+
+from ipytools import hdisplay
+from ipytools import _telemetry
+
+
+@magics_class
+class CellStatsMagic(Magics):
+    """Magic Class for `%cellstats` magic.  Specifies arguments and argument handling"""
+    def __init__(self, shell, telemetry):
+        super(CellStatsMagic, self).__init__(shell)
+        self.telemetry = telemetry
+
+    @magic_arguments()
+    @argument(
+        '-s', '--sort', default='wall', choices=['wall', 'cpu', 'memory', 'output'],
+            help='rank cells by wall time, CPU time, RSS high-water-mark growth or output size'
+    )
+    @argument(
+        '-n', '--limit', type=int, default=10,
+            help='number of cells to show'
+    )
+    @argument(
+        '-a', '--all', action='store_true',
+            help='aggregate every recorded session, with per-cell trends'
+    )
+    @argument(
+        '--notebook', default=None,
+            help='with --all, only cells of this notebook key'
+    )
+    @argument(
+        '--off', action='store_true',
+            help='stop recording cells in this session'
+    )
+    @argument(
+        '--on', action='store_true',
+            help='resume recording after --off'
+    )
+    @line_magic
+    def cellstats(self, line):
+        """`%cellstats` shows the slowest or most memory-hungry cells
+
+        Every cell run after `import ipytools` or `%load_ext cellstats` is
+        recorded to a SQLite database (~/.ipython/ipytools/telemetry.sqlite
+        or the path in IPYTOOLS_TELEMETRY_DB).  With --all the cells of past
+        sessions are grouped by notebook and source hash, and the latest run
+        is compared with the mean of the earlier ones.
+
+        Memory is how far a cell raised the process' RSS high-water mark,
+        not the cell's own peak: a cell that stays below an earlier peak
+        shows 0 B.
+
+        Examples
+        --------
+        >>> %cellstats
+
+        >>> %cellstats -s memory -n 5
+
+        >>> %cellstats --all --notebook etl/daily.ipynb
+        """
+        args = parse_argstring(self.cellstats, line)
+        if args.off:
+            self.telemetry.unregister()
+            return
+        if args.on:
+            self.telemetry.register()
+            return
+        hdisplay(self.telemetry.report(sort=args.sort, limit=args.limit,
+                                       history=args.all, notebook=args.notebook))
+
+
+def load_ipython_extension(ip):
+    """Load the extension in IPython."""
+    global _loaded
+    if not _loaded:
+        ip.register_magics(CellStatsMagic(ip, _telemetry.enable(ip)))
+        _loaded = True
+
+_loaded = False
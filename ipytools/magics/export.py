@@ -1,26 +1,78 @@
 import os, sys
 
 import json
-import urllib2
+import threading
+import time
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
 
 from IPython import get_ipython
 from IPython.core.magic import Magics, magics_class, line_magic, cell_magic
 from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
+from IPython.core.error import UsageError
 
-from IPython.lib import kernel
-from IPython.html.notebookapp import list_running_servers
+from IPython.display import display, FileLink, HTML, Javascript
+try:
+    from IPython.display import DisplayHandle
+except ImportError:
+    # IPython < 5.4: no display ids, so no updates in place
+    DisplayHandle = None
 
-from IPython.display import display, Javascript
+from ipytools import _export
+from ipytools._html import escape
 
 ipython = get_ipython()
 
-def get_notebook_name():
+# results of slow lookups, filled on first use by `_cached`
+_cache = {}
+
+def _cached(key, func, *args):
+    """return func(*args), computed once per `key`
+
+    None and empty results are not kept, so the next call looks again.
+    """
+    if key not in _cache:
+        value = func(*args)
+        if not value:
+            return value
+        _cache[key] = value
+    return _cache[key]
+
+# kernel id -> notebook path, refreshed from the servers only on a miss
+_kernel_paths = {}
+
+def _fetch_sessions(server, timeout):
+    """sessions of one notebook server, or [] when it does not answer in time"""
+    url = server['url'] + 'api/sessions'
+    if server.get('token'):
+        url += '?token=' + server['token']
+    try:
+        response = urlopen(url, timeout=timeout)
+        try:
+            sessions = json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+    except Exception:
+        return []
+    return sessions if isinstance(sessions, list) else [sessions]
+
+def get_notebook_name(refresh=False, timeout=2.0):
     """
     Fetch current notebook's name through IPython
 
+    Running servers are queried concurrently, once each, and every request
+    gives up after `timeout` seconds.  The kernel-id-to-notebook mapping is
+    cached, so later calls only contact the servers when the kernel is
+    missing from it.
+
     Parameters
     ----------
-    None
+    refresh : bool
+        drop the cached mapping first, e.g. after the notebook was renamed
+    timeout : float
+        seconds to wait for each server
 
     Return
     ------
@@ -31,27 +83,36 @@ def get_notebook_name():
     -----
     The python in this function could be replaced with Javascript
     """
-    def sess_open(url):
-        try:
-            urllib2.urlopen(url+'api/sessions')
-            return True
-        except:
-            return False
-    load = lambda url: json.loads(urllib2.urlopen(url+'api/sessions').fp.read())
-    base = lambda path: os.path.basename(path)
-    nbpath = lambda session: base(session['notebook']['path'])
-    nbid = lambda session: session['kernel']['id']
-
-    connection_file_path = kernel.get_connection_file()
-    connection_file = base(connection_file_path)
+    from multiprocessing.pool import ThreadPool
+    try:
+        from ipykernel.connect import get_connection_file
+        from notebook.notebookapp import list_running_servers
+    except ImportError:
+        from IPython.lib.kernel import get_connection_file
+        from IPython.html.notebookapp import list_running_servers
+
+    connection_file = os.path.basename(get_connection_file())
     kernel_id = connection_file.split('-', 1)[1].split('.')[0]
 
-    sessions = [load(data['url']) for data in list_running_servers() if sess_open(data['url'])]
-    sessions = reduce(list.__add__, sessions) if isinstance(sessions[0], list) else sessions
-
-    notebook_name = [nbpath(sess) for sess in sessions if nbid(sess) == kernel_id]
+    if refresh:
+        _kernel_paths.clear()
+    if kernel_id not in _kernel_paths:
+        servers = list(list_running_servers())
+        if servers:
+            pool = ThreadPool(min(len(servers), 16))
+            try:
+                fetch = lambda server: _fetch_sessions(server, timeout)
+                for sessions in pool.imap_unordered(fetch, servers):
+                    for session in sessions:
+                        _kernel_paths[session['kernel']['id']] = os.path.basename(session['notebook']['path'])
+                    if kernel_id in _kernel_paths:
+                        break
+            finally:
+                pool.terminate()
+
+    notebook_name = _kernel_paths.get(kernel_id)
     if notebook_name:
-        return notebook_name[0]
+        return notebook_name
     else:
         sys.stderr.write('No notebook name was found.  Export manually.')
         sys.stderr.flush()
@@ -81,12 +142,136 @@ def get_files(directory='~/.ipython/extensions/templates', ext='.tpl'):
     all_files.sort()
     return all_files
 
+class _TemplateChoices(object):
+    """`--template` choices, read from the template directory on first use"""
+    def _files(self):
+        return _cached('templates', get_files)
+
+    def __contains__(self, item):
+        if item in self._files():
+            return True
+        # the template may have been added since the directory was read
+        _cache.pop('templates', None)
+        return item in self._files()
+
+    def __iter__(self):
+        return iter(self._files())
+
+    def __len__(self):
+        return len(self._files())
+
+class _BackgroundExport(object):
+    """Run the save/rewrite/convert/write stages of `%export` in a worker thread
+
+    The save is requested from the main thread, since it is a Javascript
+    display; the worker waits for the file to change and does the rest.
+    Progress is shown in a display, created on the main thread and updated
+    in place through its display id, ending with a link to the exported
+    file.  If the save is not seen within `save_timeout` seconds the file
+    on disk is exported anyway and the display says so.
+    """
+    stages = ['save', 'rewrite', 'convert', 'write']
+
+    def __init__(self, magic, args, save_timeout=10.0):
+        self.magic = magic
+        self.args = args
+        self.save_timeout = save_timeout
+        self.started = {}
+        self.finished = {}
+        self.current = None
+        self.failed = None
+        self.output = None
+        self.error = None
+        self.handle = None
+        self.save_missed = False
+        self._before = None
+
+    def start(self):
+        self.handle = display(HTML(self._render()), display_id=True)
+        # the save goes through the frontend, so it is requested from the
+        # kernel's main thread; the worker only waits for the file to change
+        filename = self.args['filename']
+        self._before = os.path.getmtime(filename) if os.path.exists(filename) else None
+        self._stage('save')
+        self.magic._save_notebook()
+        self.thread = threading.Thread(target=self._run, name='ipytools-export')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def _stage(self, name):
+        now = time.time()
+        if self.current is not None:
+            self.finished[self.current] = now
+        self.current = name
+        self.started[name] = now
+        self._update()
+
+    def _wait_for_save(self, path):
+        """wait until the frontend's save touches `path`, up to `save_timeout` seconds
+
+        Returns False if it did not.
+        """
+        deadline = time.time() + self.save_timeout
+        while time.time() < deadline:
+            if os.path.exists(path) and os.path.getmtime(path) != self._before:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _run(self):
+        filename = self.args['filename']
+        try:
+            self.save_missed = not self._wait_for_save(filename)
+            self._stage('rewrite')
+            self.magic._rewrite_execution_order(filename, drop_export_cell=True)
+            self.output = _export.export_notebook(
+                filename, to=self.args['to'], template=self.args['template'], progress=self._stage)
+        except Exception as e:
+            self.error = '{}: {}'.format(type(e).__name__, e)
+            self.failed = self.current
+        if self.current is not None:
+            self.finished[self.current] = time.time()
+        self.current = None
+        self._update()
+
+    def _render(self):
+        rows = []
+        for stage in self.stages:
+            if stage == self.failed:
+                mark, detail = '&#10007;', 'failed'
+            elif stage == 'save' and self.save_missed:
+                mark, detail = '&#9888;', 'not detected in {:g}s'.format(self.save_timeout)
+            elif stage in self.finished:
+                mark, detail = '&#10003;', '{:.2f}s'.format(self.finished[stage] - self.started[stage])
+            elif stage == self.current:
+                mark, detail = '&#8230;', 'running'
+            else:
+                mark, detail = '', ''
+            rows.append('<tr><td>{}</td><td style="text-align:left;">{}</td><td>{}</td></tr>'.format(mark, stage, detail))
+        footer = ''
+        if self.save_missed:
+            footer = ('<p style="color:#a60;">The notebook save was not detected; exporting the '
+                      'copy on disk, which may miss recent changes.</p>')
+        if self.error:
+            footer += '<p style="color:#b00;">Export failed: {}</p>'.format(
+                escape(self.error))
+        elif self.output:
+            footer += '<p>Exported: {}</p>'.format(FileLink(self.output)._repr_html_())
+        return '<div class="ipytools-export"><b>%export {}</b><table>{}</table>{}</div>'.format(
+            escape(self.args['filename']), ''.join(rows), footer)
+
+    def _update(self):
+        # only through the display handle: output written from this
+        # thread would land in whichever cell is running
+        self.handle.update(HTML(self._render()))
+
 @magics_class
 class ExportMagic(Magics):
     """Magic Class for `%export` magic.  Specifies arguments and argument handling"""
     @magic_arguments()
     @argument(
-        'filename', default=get_notebook_name(),
+        'filename', default=None,
             help='filename passed for export to html'
     )
     @argument(
@@ -96,9 +281,13 @@ class ExportMagic(Magics):
             help='Choose a filetype to convert to'
     )
     @argument(
-        '-t', '--template', default=get_files()[0], choices=get_files(),
+        '-t', '--template', default=None, choices=_TemplateChoices(), metavar='TEMPLATE',
             help='Choose a .tpl file to format the .ipynb'
     )
+    @argument(
+        '-b', '--background', action='store_true',
+            help='export in a worker thread and report progress while the kernel stays usable'
+    )
     @line_magic
     def export(self, line):
         """`%export` packages and exports the current notebook session
@@ -116,6 +305,10 @@ class ExportMagic(Magics):
                 specify target file type for conversion
             --t, --template: str (optional)
                 specify .tpl file to serve as template
+            -b, --background : flag
+                convert in a worker thread; progress (save, rewrite, convert,
+                write) and a link to the result update below the cell.
+                Needs IPython 5.4+
 
         Examples
         --------
@@ -123,6 +316,8 @@ class ExportMagic(Magics):
 
         >>> %export --to slides --template my_slide_template.tpl
 
+        >>> %export --background
+
         Todo
         ----
             1 : Add handling for "directory does not exist"
@@ -130,29 +325,28 @@ class ExportMagic(Magics):
         """
 
 
+        args = self._parse_line(line)
+        if args['background']:
+            if DisplayHandle is None:
+                raise UsageError('--background needs display ids (IPython 5.4+); run %export without it')
+            # the cell stays so its output can show progress; the %export
+            # cell is dropped from the saved file instead
+            self._renumber_cells()
+            self.background = _BackgroundExport(self, args).start()
+            return
+
         self._remove_last_cell()
         self._renumber_cells()
         self._save_notebook()
-        self._nbconvert(line)
+        self._nbconvert(args)
 
 
-    def _nbconvert(self, line):
+    def _nbconvert(self, args):
 
-        args = self._parse_line(line)   
-        command = self._build_command(args)
         filename = args['filename']
         self._rewrite_execution_order(filename)
-        ipython.run_cell_magic('bash', line='', cell=command)
-
-
-    def _build_command(self, args):
-        command = 'ipython nbconvert --to {to} "{filename}" --template {template}'.format(**args)
-
-        reveal_prefix = '--reveal-prefix "https://cdn.jsdelivr.net/reveal.js/2.6.2"'
-        if args.get('to', False) and args['to'] == 'slides':
-            command = ' '.join([command, reveal_prefix])
-
-        return command
+        output = _export.export_notebook(filename, to=args['to'], template=args['template'])
+        sys.stdout.write('Exported {} to {}\n'.format(filename, output))
 
 
     def _format_filename(self, args):
@@ -170,15 +364,28 @@ class ExportMagic(Magics):
         return args
 
 
+    @staticmethod
+    def _notebook_name(refresh=False):
+        return get_notebook_name(refresh=refresh)
+
     def _parse_line(self, line):
-        if line in [None, '']:
-            line = '"{0}"'.format(get_notebook_name())
-        elif line.strip()[0] == '-':
-            filename = '"{}"'.format(get_notebook_name())
-            line = ' '.join([filename, line])
+        implicit = line in [None, ''] or line.strip()[0] == '-'
+        if implicit:
+            filename = '"{}"'.format(self._notebook_name())
+            line = ' '.join([filename, line or ''])
 
         args = parse_argstring(self.export, line).__dict__
 
+        if implicit and not os.path.exists(self._format_filename(dict(args))['filename']):
+            # the notebook was renamed since its name was cached
+            args['filename'] = '"{}"'.format(self._notebook_name(refresh=True))
+
+        if args['template'] is None:
+            templates = list(_TemplateChoices())
+            if not templates:
+                raise ValueError('no .tpl templates found in ~/.ipython/extensions/templates')
+            args['template'] = templates[0]
+
         args = self._format_filename(args)
 
         return args
@@ -209,14 +416,19 @@ class ExportMagic(Magics):
             }
             """))
 
-    def _rewrite_execution_order(self, title):
+    def _rewrite_execution_order(self, title, drop_export_cell=False):
         data = json.load(open(title))
+        if drop_export_cell and data['cells']:
+            source = data['cells'][-1].get('source', '')
+            source = ''.join(source) if isinstance(source, list) else source
+            if source.lstrip().startswith('%export'):
+                data['cells'].pop()
         count = 1
         for cell in data['cells']:
             if 'execution_count' in cell:
                 cell['execution_count'] = count
                 count += 1
-        json.dump(data, open(title, 'wb'))
+        json.dump(data, open(title, 'w'))
 
     def _save_notebook(self):
         display(Javascript("""
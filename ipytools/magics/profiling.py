@@ -0,0 +1,218 @@
+import sys
+from datetime import datetime
+
+from IPython.core.magic import Magics, magics_class, cell_magic, line_magic
+from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
+from IPython.core.error import UsageError
+
+from ipytools import hdisplay
+from ipytools import _cprofile, _importtime, _lprofile, _memtrace
+
+
+@magics_class
+class ProfilingMagic(Magics):
+    """Magic Class for profiling cell magics.  Specifies arguments and argument handling"""
+    def _compile(self, cell, filename):
+        source = self.shell.input_transformer_manager.transform_cell(cell)
+        return self.shell.compile(source, filename, 'exec')
+
+    @magic_arguments()
+    @argument(
+        '-s', '--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'],
+            help='column used to pick the top functions'
+    )
+    @argument(
+        '-l', '--limit', type=int, default=30,
+            help='number of functions to show'
+    )
+    @argument(
+        '-o', '--output', default=None,
+            help='.prof file to write, default cprofile_<timestamp>.prof'
+    )
+    @argument(
+        '--no-save', action='store_true',
+            help='do not write a .prof file'
+    )
+    @cell_magic
+    def cprofile(self, line, cell):
+        """`%%cprofile` runs a cell under cProfile and shows a sortable table
+
+        Columns are cumulative time, own time, call counts, callers and
+        callees; click a header to sort.  The raw stats are saved to a
+        .prof file for later comparison with pstats or snakeviz.
+
+        Examples
+        --------
+        >>> %%cprofile
+        ... model.fit(X, y)
+
+        >>> %%cprofile -s tottime -l 15 -o fit_v2.prof
+        ... model.fit(X, y)
+        """
+        args = parse_argstring(self.cprofile, line)
+        path = None
+        if not args.no_save:
+            path = args.output or 'cprofile_{}.prof'.format(datetime.now().strftime('%Y%m%d%H%M%S'))
+
+        code = self._compile(cell, '<cprofile>')
+        result = _cprofile.run(code, self.shell.user_ns, path=path,
+                               sort=args.sort, limit=args.limit)
+        hdisplay(result)
+
+    @magic_arguments()
+    @argument(
+        '-f', '--function', action='append', required=True,
+            help='expression naming a function or method to profile; repeatable'
+    )
+    @argument(
+        '-o', '--output', default=None,
+            help='store the LProfileResult in this user variable'
+    )
+    @cell_magic
+    def lprofile(self, line, cell):
+        """`%%lprofile` shows per-line hits and time of selected functions
+
+        Each -f expression is evaluated in the user namespace; the cell then
+        runs with those functions instrumented and their source is shown
+        with hit counts, time per line and a heat-colored time column.
+        Uses sys.monitoring on Python 3.12+ and sys.settrace before.
+
+        Examples
+        --------
+        >>> %%lprofile -f clean_rows
+        ... clean_rows(df)
+
+        >>> %%lprofile -f Model.fit -f Model._step
+        ... model.fit(X, y)
+        """
+        args = parse_argstring(self.lprofile, line)
+        namespace = self.shell.user_ns
+        functions = []
+        for expression in args.function:
+            try:
+                functions.append(eval(expression, namespace))
+            except Exception as e:
+                raise UsageError('cannot evaluate -f {}: {}'.format(expression, e))
+        try:
+            profiler = _lprofile.LineProfiler(functions)
+        except TypeError as e:
+            raise UsageError(str(e))
+
+        code = self._compile(cell, '<lprofile>')
+        try:
+            with profiler:
+                exec(code, namespace)
+        finally:
+            result = profiler.result()
+            if args.output:
+                namespace[args.output] = result
+            hdisplay(result)
+
+    @magic_arguments()
+    @argument(
+        '-g', '--group', default='lineno', choices=['lineno', 'traceback', 'filename'],
+            help='group allocations by line, by full traceback or by file'
+    )
+    @argument(
+        '-l', '--limit', type=int, default=10,
+            help='number of allocation sites to show'
+    )
+    @argument(
+        '-f', '--frames', type=int, default=10,
+            help='frames kept per allocation when grouping by traceback'
+    )
+    @argument(
+        '--leak', type=int, default=None, metavar='RUNS',
+            help='leak mode: run the cell RUNS times and report sites growing on every run'
+    )
+    @argument(
+        '-o', '--output', default=None,
+            help='store the result in this user variable'
+    )
+    @cell_magic
+    def memtrace(self, line, cell):
+        """`%%memtrace` shows the allocation sites that grew while a cell ran
+
+        tracemalloc snapshots are taken before and after the cell and the
+        sites with the largest net growth are listed.  With --leak the cell
+        runs several times and sites that keep growing on every run are
+        flagged, separating leaks from caches that fill once.
+
+        Needs tracemalloc (Python 3.4+).  On older interpreters the magic
+        is not registered and loading the extension says so once.
+
+        Examples
+        --------
+        >>> %%memtrace
+        ... df = load_frame(path)
+
+        >>> %%memtrace --leak 5 -g traceback
+        ... handler.process(batch)
+        """
+        args = parse_argstring(self.memtrace, line)
+        if args.leak is not None and args.leak < 2:
+            raise UsageError('--leak needs at least 2 runs')
+
+        code = self._compile(cell, '<memtrace>')
+        result = _memtrace.run(code, self.shell.user_ns, group=args.group,
+                               limit=args.limit, frames=args.frames,
+                               repeat=args.leak or 1)
+        if args.output:
+            self.shell.user_ns[args.output] = result
+        hdisplay(result)
+
+    @magic_arguments()
+    @argument(
+        'statement', nargs='+',
+            help='import statement to time, e.g. "import pandas"'
+    )
+    @argument(
+        '-s', '--sort', default='cumulative', choices=['cumulative', 'self', 'order'],
+            help='order of sibling modules in the tree'
+    )
+    @argument(
+        '-m', '--min', type=float, default=0.1,
+            help='hide modules whose cumulative time is below this many ms'
+    )
+    @argument(
+        '-o', '--output', default=None,
+            help='store the ImportReport in this user variable'
+    )
+    @line_magic
+    def importtime(self, line):
+        """`%importtime` times every module an import statement loads
+
+        Works like `python -X importtime` inside the running kernel: each
+        newly loaded module is shown with its own (self) and cumulative
+        import time in a collapsible tree, so slow dependencies can be
+        deferred.  Modules already in sys.modules cost nothing and are not
+        shown, so run it before anything else imports them.
+
+        Examples
+        --------
+        >>> %importtime import pandas as pd
+
+        >>> %importtime -s self -m 1 import seaborn
+        """
+        args = parse_argstring(self.importtime, line)
+        code = self._compile(' '.join(args.statement), '<importtime>')
+        timer = _importtime.ImportTimer()
+        with timer:
+            exec(code, self.shell.user_ns)
+        result = timer.report(sort=args.sort, min_ns=int(args.min * 1e6))
+        if args.output:
+            self.shell.user_ns[args.output] = result
+        hdisplay(result)
+
+
+def load_ipython_extension(ip):
+    """Load the extension in IPython."""
+    global _loaded
+    if not _loaded:
+        ip.register_magics(ProfilingMagic)
+        if _memtrace.tracemalloc is None:
+            ip.magics_manager.magics['cell'].pop('memtrace', None)
+            sys.stderr.write('%%memtrace is not available: it needs tracemalloc (Python 3.4+)\n')
+        _loaded = True
+
+_loaded = False
@@ -19,6 +19,9 @@ config = {
     'dependency_links': [],
     'packages': find_packages(),
     'scripts': [],
+    'entry_points': {
+        'console_scripts': ['ipytools-export = ipytools._batch:main'],
+    },
     'name': 'ipytools',
 }
 